@@ -70,11 +70,16 @@ class HTML(object):
         Defaults to ``'print'``. **Note:** In some cases like
         ``HTML(string=foo)`` relative URLs will be invalid if ``base_url``
         is not provided.
+    :param prefetch_concurrency: The number of threads used to fetch
+        stylesheets and images in advance when rendering, or ``0`` to fetch
+        them one after the other when needed. Defaults to ``0``.
+        ``url_fetcher`` must be thread-safe when this is used.
 
     """
     def __init__(self, guess=None, filename=None, url=None, file_obj=None,
                  string=None, tree=None, encoding=None, base_url=None,
-                 url_fetcher=default_url_fetcher, media_type='print'):
+                 url_fetcher=default_url_fetcher, media_type='print',
+                 prefetch_concurrency=0):
         result = _select_source(
             guess, filename, url, file_obj, string, tree, base_url,
             url_fetcher)
@@ -100,9 +105,10 @@ class HTML(object):
         self.base_url = base_url
         self.url_fetcher = url_fetcher
         self.media_type = media_type
+        self.prefetch_concurrency = prefetch_concurrency
 
     def _ua_stylesheets(self):
-        return [HTML5_UA_STYLESHEET]
+        return [get_ua_stylesheet()]
 
     def _get_metadata(self):
         return get_html_metadata(self.root_element)
@@ -334,5 +340,5 @@ def _select_source(guess=None, filename=None, url=None, file_obj=None,
 
 # Work around circular imports.
 from .css import PARSER, preprocess_stylesheet
-from .html import find_base_url, HTML5_UA_STYLESHEET, get_html_metadata
+from .html import find_base_url, get_ua_stylesheet, get_html_metadata
 from .document import Document, Page
@@ -17,6 +17,7 @@ import sys
 import argparse
 
 from . import VERSION, HTML
+from .text import preload_fonts
 
 
 def main(argv=None, stdout=None, stdin=None):
@@ -66,6 +67,12 @@ def main(argv=None, stdout=None, stdin=None):
         Adds an attachment to the document which is included in the PDF output.
         This option can be added multiple times to attach more files.
 
+    .. option:: --preload-fonts <families>
+
+        Load the fonts of a comma-separated list of families before reading
+        the input (eg. ``--preload-fonts "DejaVu Sans,serif"``), in normal
+        and bold weights and in normal and italic styles.
+
     .. option:: --version
 
         Show the version number. Other options and arguments are ignored.
@@ -100,6 +107,9 @@ def main(argv=None, stdout=None, stdin=None):
     parser.add_argument('-a', '--attachment', action='append',
                         help='URL or filename of a file '
                              'to attach to the PDF document')
+    parser.add_argument('--preload-fonts', metavar='FAMILIES',
+                        help='Comma-separated list of font families to load '
+                             'before reading the input.')
     parser.add_argument(
         'input', help='URL or filename of the HTML input, or - for stdin')
     parser.add_argument(
@@ -151,6 +161,11 @@ def main(argv=None, stdout=None, stdin=None):
         else:
             parser.error('--attachment only applies for the PDF format.')
 
+    if args.preload_fonts:
+        preload_fonts([
+            family.strip() for family in args.preload_fonts.split(',')
+            if family.strip()])
+
     html = HTML(source, base_url=args.base_url, encoding=args.encoding,
                 media_type=args.media_type)
     getattr(html, 'write_' + format_)(output, **kwargs)
@@ -0,0 +1,270 @@
+# coding: utf8
+"""
+    weasyprint.cache
+    ----------------
+
+    A cache for external resources, shared by documents and renders.
+
+    :copyright: Copyright 2011-2014 Simon Sapin and contributors, see AUTHORS.
+    :license: BSD, see LICENSE for details.
+
+"""
+
+from __future__ import division, unicode_literals
+
+import os
+import time
+import pickle
+import hashlib
+import tempfile
+import email.utils
+
+from .urls import (
+    default_url_fetcher, response_to_result, open_url, iri_to_uri,
+    HTTP_HEADERS)
+from .compat import HTTPError
+from .lru import LRUCache
+
+
+def get_expires(headers, now):
+    """Return the time when a HTTP response becomes stale.
+
+    Follow the *Cache-Control* and *Expires* headers. Responses without
+    any of them are stale right away, and can only be reused after a
+    conditional request. Return :obj:`None` if the response must not be
+    stored.
+
+    """
+    directives = {}
+    for directive in (headers.get('Cache-Control') or '').split(','):
+        name, _, value = directive.strip().partition('=')
+        directives[name.lower()] = value.strip('"')
+    if 'no-store' in directives:
+        return None
+    elif 'no-cache' in directives:
+        return now
+    elif 'max-age' in directives:
+        try:
+            return now + int(directives['max-age'])
+        except ValueError:
+            return now
+    elif headers.get('Expires'):
+        date = email.utils.parsedate_tz(headers['Expires'])
+        return now if date is None else email.utils.mktime_tz(date)
+    else:
+        return now
+
+
+def get_image_size(image):
+    """Return the approximate memory size of a decoded image, in bytes.
+
+    Raster images that are decoded lazily are counted with the size of their
+    decoded pixels, as they are not stored again once decoded.
+
+    """
+    return getattr(image, 'surface_size', 0)
+
+
+class CachedResource(object):
+    """A resource in a :class:`ResourceCache`.
+
+    ``result`` is the url_fetcher result, with the content in ``string``.
+    ``etag`` and ``last_modified`` are the validators sent in conditional
+    requests. ``image`` is the decoded image, set by :class:`ImageCache`.
+
+    """
+    def __init__(self, result, etag, last_modified, expires):
+        self.result = result
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+        self.image = None
+
+    def get_size(self):
+        return len(self.result['string']) + get_image_size(self.image)
+
+    def __getstate__(self):
+        # Decoded images are only kept in memory.
+        return dict(result=self.result, etag=self.etag,
+                    last_modified=self.last_modified, expires=self.expires)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+class ResourceCache(object):
+    """An url_fetcher keeping the fetched resources for later renders.
+
+    Give an instance as the ``url_fetcher`` parameter of :class:`HTML` or
+    :class:`CSS`, and use the same instance for all the documents.
+
+    Only HTTP and HTTPS resources are cached, other URLs are given to
+    ``url_fetcher``. Responses are kept according to their *Cache-Control*
+    and *Expires* headers, and stale responses are validated with
+    conditional requests when they have an *ETag* or a *Last-Modified*
+    header. Decoded images are kept with their resource.
+
+    :param maxsize:
+        The maximum size in bytes of the resources and decoded images kept in
+        memory.
+    :param directory:
+        A directory where resources are also stored, to share them between
+        processes, or :obj:`None`.
+    :param url_fetcher:
+        The url_fetcher used for resources that are not fetched with HTTP.
+
+    """
+    def __init__(self, maxsize=64 * 1024 * 1024, directory=None,
+                 url_fetcher=default_url_fetcher):
+        self.resources = LRUCache(maxsize, getsize=CachedResource.get_size)
+        self.directory = directory
+        self.url_fetcher = url_fetcher
+
+    def __call__(self, url):
+        if not url.lower().startswith(('http:', 'https:')):
+            return self.url_fetcher(url)
+        return dict(self.validate(url).result)
+
+    def get(self, url):
+        """Return the :class:`CachedResource` for ``url`` without any network
+        access, or :obj:`None`.
+
+        """
+        resource = self.resources.get(url)
+        if resource is None and self.directory is not None:
+            try:
+                with open(self._get_filename(url), 'rb') as fd:
+                    resource = pickle.load(fd)
+            except Exception:
+                return None
+            self.resources[url] = resource
+        return resource
+
+    def validate(self, url):
+        """Return a fresh :class:`CachedResource` for ``url``.
+
+        The resource is fetched or validated if needed. Responses that can
+        not be stored are returned but not kept.
+
+        """
+        resource = self.get(url)
+        now = time.time()
+        if resource is not None and resource.expires > now:
+            return resource
+
+        headers = dict(HTTP_HEADERS)
+        if resource is not None:
+            if resource.etag:
+                headers['If-None-Match'] = resource.etag
+            if resource.last_modified:
+                headers['If-Modified-Since'] = resource.last_modified
+        try:
+            response = open_url(iri_to_uri(url), headers)
+        except HTTPError as exc:
+            if exc.code != 304 or resource is None:
+                raise
+            # Not Modified
+            expires = get_expires(exc.info(), now)
+            if expires is None:
+                self.remove(url)
+                return resource
+            resource.expires = expires
+            if exc.info().get('ETag'):
+                resource.etag = exc.info()['ETag']
+        else:
+            info = response.info()
+            result = response_to_result(response)
+            if 'file_obj' in result:
+                file_obj = result.pop('file_obj')
+                try:
+                    result['string'] = file_obj.read()
+                finally:
+                    file_obj.close()
+            expires = get_expires(info, now)
+            etag = info.get('ETag')
+            last_modified = info.get('Last-Modified')
+            if expires is None or (
+                    expires <= now and not (etag or last_modified)):
+                # Can not be reused, return it without keeping it.
+                self.remove(url)
+                return CachedResource(result, None, None, now)
+            resource = CachedResource(result, etag, last_modified, expires)
+        self.store(url, resource)
+        return resource
+
+    def store(self, url, resource, memory_only=False):
+        """Keep ``resource`` in memory and on disk."""
+        self.resources[url] = resource
+        if memory_only or self.directory is None:
+            return
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # Write in a temporary file first so that concurrent processes
+            # never read a partial resource.
+            fd, temp_filename = tempfile.mkstemp(dir=self.directory)
+            try:
+                with os.fdopen(fd, 'wb') as temp_file:
+                    pickle.dump(resource, temp_file, pickle.HIGHEST_PROTOCOL)
+                os.rename(temp_filename, self._get_filename(url))
+            except Exception:
+                os.remove(temp_filename)
+                raise
+        except Exception:
+            pass
+
+    def remove(self, url):
+        """Forget the resource for ``url``."""
+        self.resources.pop(url)
+        if self.directory is not None:
+            try:
+                os.remove(self._get_filename(url))
+            except OSError:
+                pass
+
+    def image_cache(self):
+        """Return a new :class:`ImageCache` for a single render."""
+        return ImageCache(self)
+
+    def _get_filename(self, url):
+        return os.path.join(self.directory, '%s.pickle' % (
+            hashlib.sha1(url.encode('utf8')).hexdigest()))
+
+
+class ImageCache(object):
+    """The images of a render, for :func:`images.get_image_from_uri`.
+
+    Images decoded from resources of a :class:`ResourceCache` are kept with
+    these resources and reused as long as they are fresh or validated.
+
+    """
+    def __init__(self, resource_cache):
+        self.resource_cache = resource_cache
+        self.images = {}
+
+    def get(self, url, default=None):
+        if url in self.images:
+            return self.images[url]
+        resource = self.resource_cache.get(url)
+        if resource is not None and resource.image is not None:
+            # Validate the resource before using the image. Otherwise
+            # get_image_from_uri() fetches the resource, and the url_fetcher
+            # validates it on its own.
+            try:
+                resource = self.resource_cache.validate(url)
+            except Exception:
+                # get_image_from_uri() will report the error.
+                resource = None
+            if resource is not None and resource.image is not None:
+                self.images[url] = resource.image
+                return resource.image
+        return default
+
+    def __setitem__(self, url, image):
+        self.images[url] = image
+        if image is not None:
+            resource = self.resource_cache.get(url)
+            if resource is not None and resource.image is None:
+                resource.image = image
+                # Update the size of the resource.
+                self.resource_cache.store(url, resource, memory_only=True)
@@ -16,12 +16,15 @@ import sys
 import email
 
 
-__all__ = ['Request', 'base64_decode', 'base64_encode', 'basestring',
+__all__ = ['HTTPConnection', 'HTTPError', 'HTTPException', 'HTTPSConnection',
+           'OrderedDict', 'Request', 'base64_decode', 'base64_encode',
+           'basestring', 'getproxies',
            'ints_from_bytes', 'iteritems', 'izip', 'parse_email', 'parse_qs',
-           'pathname2url', 'quote', 'unicode', 'unquote', 'unquote_to_bytes',
+           'pathname2url', 'proxy_bypass', 'quote', 'unicode', 'unquote',
+           'unquote_to_bytes',
            'urlencode', 'urljoin', 'urlopen', 'urllib_get_content_type',
            'urllib_get_charset', 'urllib_get_filename',
-           'urlparse_uses_relative', 'urlsplit', 'xrange']
+           'url2pathname', 'urlparse_uses_relative', 'urlsplit', 'xrange']
 
 
 if sys.version_info[0] >= 3:
@@ -29,7 +32,11 @@ if sys.version_info[0] >= 3:
     from urllib.parse import (
         urljoin, urlsplit, quote, unquote, unquote_to_bytes, parse_qs,
         urlencode, uses_relative as urlparse_uses_relative)
-    from urllib.request import urlopen, Request, pathname2url
+    from urllib.request import (
+        urlopen, Request, pathname2url, url2pathname, getproxies,
+        proxy_bypass)
+    from urllib.error import HTTPError
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
     from array import array
     from base64 import (decodebytes as base64_decode,
                         encodebytes as base64_encode)
@@ -62,8 +69,10 @@ else:
     # Python 2
     from urlparse import (urljoin, urlsplit, parse_qs,
                           uses_relative as urlparse_uses_relative)
-    from urllib2 import urlopen, Request
-    from urllib import pathname2url, quote, unquote, urlencode
+    from urllib2 import urlopen, Request, HTTPError
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
+    from urllib import (pathname2url, url2pathname, quote, unquote,
+                        urlencode, getproxies, proxy_bypass)
     from array import array as _array
     from itertools import izip, imap
     from base64 import (decodestring as base64_decode,
@@ -120,3 +129,12 @@ else:
     # which file-like objects for HTTP response do not have.
     # http://bugs.python.org/issue11608
     StreamingGzipFile = None
+
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # Python 2.6: caches drop arbitrary items instead of the oldest ones.
+    class OrderedDict(dict):
+        def popitem(self, last=True):
+            return dict.popitem(self)
@@ -21,6 +21,9 @@
 from __future__ import division, unicode_literals
 
 import re
+import hashlib
+import functools
+import timeit
 
 import tinycss
 import cssselect
@@ -30,9 +33,10 @@ from . import properties
 from . import computed_values
 from .validation import preprocess_declarations
 from ..urls import (element_base_url, get_url_attribute, url_join,
-                    URLFetchingError)
+                    url_is_absolute, URLFetchingError, PrefetchingURLFetcher)
 from ..logger import LOGGER
-from ..compat import iteritems
+from ..compat import iteritems, basestring
+from ..lru import LRUCache
 from .. import CSS
 
 
@@ -64,6 +68,18 @@ PAGE_PSEUDOCLASS_TARGETS = {
         'first_blank_left_page', 'first_blank_right_page'],
 }
 
+# Preprocessed stylesheets shared by all documents, see
+# set_stylesheet_cache_size(). Disabled by default.
+STYLESHEET_CACHE = None
+
+# Compiled selectors, see get_selector_list().
+TRANSLATOR = cssselect.HTMLTranslator()
+SELECTOR_CACHE = LRUCache(maxsize=4096)
+
+# Preprocessed declarations of "style" attributes, see
+# get_style_attribute_declarations().
+STYLE_ATTRIBUTE_CACHE = LRUCache(maxsize=4096)
+
 # A test function that returns True if the given property name has an
 # initial value that is not always the same when computed.
 RE_INITIAL_NOT_COMPUTED = re.compile(
@@ -79,6 +95,12 @@ class StyleDict(object):
                    dict will be looked up in the parent dict. Setting a value
                    in this dict masks any value in the parent.
 
+    Computed styles of elements and boxes are :class:`ComputedStyle`
+    objects. ``StyleDict`` is kept for the specified values given to
+    :func:`computed_values.compute`, whose defaults come from ``parent``,
+    and for the computed values of the root element before they are
+    stored in a :class:`ComputedStyle`.
+
     """
     def __init__(self, data=None, parent=None):
         if data is None:
@@ -151,6 +173,164 @@ class StyleDict(object):
     anonymous = False
 
 
+# Computed styles store inherited and non-inherited values in two groups,
+# each one being a tuple (shared) or a list (owned by a single style).
+INHERITED_NAMES = tuple(sorted(properties.INHERITED))
+NON_INHERITED_NAMES = tuple(sorted(
+    set(properties.INITIAL_VALUES) - properties.INHERITED))
+INHERITED_COUNT = len(INHERITED_NAMES)
+PROPERTY_INDEXES = dict(
+    (name, i) for i, name in enumerate(INHERITED_NAMES + NON_INHERITED_NAMES))
+
+# Non-inherited values of styles with no cascaded value. border-*-style is
+# none, so border-width computes to zero. Other than that, properties that
+# would need computing are border-*-color, but they do not apply.
+ANONYMOUS_NON_INHERITED = tuple(
+    0 if name in ('border_top_width', 'border_bottom_width',
+                  'border_left_width', 'border_right_width', 'outline_width')
+    else properties.INITIAL_VALUES[name]
+    for name in NON_INHERITED_NAMES)
+
+
+class ComputedStyle(object):
+    """A compact style with a value for each property, like :class:`StyleDict`.
+
+    Values are stored in two sequences, for inherited and non-inherited
+    properties, instead of a dict. Sequences are shared by copies and by
+    styles with the same inherited values until they are modified.
+
+    """
+    __slots__ = ('_inherited', '_non_inherited', '_extra', 'anonymous')
+
+    def __init__(self, inherited, non_inherited, extra=None, anonymous=False):
+        # work around our own __setattr__
+        object.__setattr__(self, '_inherited', inherited)
+        object.__setattr__(self, '_non_inherited', non_inherited)
+        object.__setattr__(self, '_extra', extra)
+        object.__setattr__(self, 'anonymous', anonymous)
+
+    @classmethod
+    def from_mapping(cls, mapping, parent_style=None):
+        """Return a new style with the values of a :class:`StyleDict`.
+
+        The inherited values of ``parent_style`` are shared if they are the
+        same.
+
+        """
+        inherited = tuple(mapping[name] for name in INHERITED_NAMES)
+        if isinstance(parent_style, ComputedStyle):
+            parent_inherited = parent_style._shared_inherited()
+            if all(value is parent_value for value, parent_value
+                   in zip(inherited, parent_inherited)):
+                inherited = parent_inherited
+        return cls(
+            inherited, tuple(mapping[name] for name in NON_INHERITED_NAMES))
+
+    @classmethod
+    def inheriting(cls, parent_style):
+        """Return a new style with no cascaded value.
+
+        Properties have inherited values from ``parent_style`` or initial
+        values.
+
+        """
+        if isinstance(parent_style, ComputedStyle):
+            inherited = parent_style._shared_inherited()
+        else:
+            inherited = tuple(
+                parent_style[name] for name in INHERITED_NAMES)
+        return cls(inherited, ANONYMOUS_NON_INHERITED)
+
+    def _shared_inherited(self):
+        """Return the inherited values as a tuple that can be shared."""
+        inherited = self._inherited
+        if type(inherited) is list:
+            inherited = tuple(inherited)
+            object.__setattr__(self, '_inherited', inherited)
+        return inherited
+
+    def __getitem__(self, key):
+        index = PROPERTY_INDEXES.get(key)
+        if index is None:
+            extra = self._extra
+            if extra is not None and key in extra:
+                return extra[key]
+            elif key.startswith('__'):
+                # Don't break the attribute protocol for special methods.
+                raise AttributeError(key)
+            raise KeyError(key)
+        elif index < INHERITED_COUNT:
+            return self._inherited[index]
+        else:
+            return self._non_inherited[index - INHERITED_COUNT]
+
+    def __setitem__(self, key, value):
+        index = PROPERTY_INDEXES.get(key)
+        if index is None:
+            extra = self._extra
+            if extra is None:
+                extra = {}
+                object.__setattr__(self, '_extra', extra)
+            extra[key] = value
+            return
+        elif index < INHERITED_COUNT:
+            name = '_inherited'
+        else:
+            name = '_non_inherited'
+            index -= INHERITED_COUNT
+        values = getattr(self, name)
+        if type(values) is not list:
+            # Copy on write
+            values = list(values)
+            object.__setattr__(self, name, values)
+        values[index] = value
+
+    def __contains__(self, key):
+        return key in PROPERTY_INDEXES or (
+            self._extra is not None and key in self._extra)
+
+    __getattr__ = __getitem__  # May raise KeyError instead of AttributeError
+    __setattr__ = __setitem__
+
+    def get_color(self, key):
+        value = self[key]
+        return value if value != 'currentColor' else self.color
+
+    def updated_copy(self, other):
+        copy = self.copy()
+        for key, value in iteritems(other):
+            copy[key] = value
+        return copy
+
+    def copy(self):
+        """Copy the ``ComputedStyle``.
+
+        Values are shared until they are modified in the copy or in the
+        original. Changes made after the copy are not seen by the other
+        style: the style of a box must be modified through ``box.style``.
+
+        """
+        non_inherited = self._non_inherited
+        if type(non_inherited) is list:
+            non_inherited = tuple(non_inherited)
+            object.__setattr__(self, '_non_inherited', non_inherited)
+        extra = self._extra
+        return type(self)(
+            self._shared_inherited(), non_inherited,
+            None if extra is None else dict(extra), self.anonymous)
+
+    def inherit_from(self):
+        """Return a new ``ComputedStyle`` with inherited properties from this
+        one.
+
+        Non-inherited properties get their initial values.
+        This is the styles for an anonymous box.
+        """
+        style = type(self).inheriting(self)
+        object.__setattr__(style, 'anonymous', True)
+        return style
+
+
 def get_child_text(element):
     """Return the text directly in the element, not descendants."""
     content = [element.text] if element.text else []
@@ -160,8 +340,71 @@ def get_child_text(element):
     return ''.join(content)
 
 
-def find_stylesheets(element_tree, device_media_type, url_fetcher):
-    """Yield the stylesheets in ``element_tree``.
+def set_stylesheet_cache_size(maxsize):
+    """Enable or disable the process-wide cache of stylesheets.
+
+    When enabled, stylesheets from ``<link>`` elements, ``<style>`` elements
+    and ``@import`` rules are parsed, validated and their selectors compiled
+    only once, and then shared by the following documents.
+
+    Stylesheets are cached by URL, or by content for ``<style>`` elements,
+    and by media type and url_fetcher: documents using different
+    url_fetchers do not share stylesheets. Cached URLs are not fetched
+    again: the cache is only meant for stylesheets that do not change while
+    the process is running.
+
+    :param maxsize:
+        The maximum number of stylesheets kept in the cache, the least
+        recently used ones being removed first. ``0`` or :obj:`None`
+        disables and empties the cache.
+
+    """
+    global STYLESHEET_CACHE
+    STYLESHEET_CACHE = LRUCache(maxsize) if maxsize else None
+
+
+def get_stylesheet_key(source_key, check_mime_type, device_media_type,
+                       base_url, url_fetcher):
+    """Return the key of a stylesheet in :obj:`STYLESHEET_CACHE`."""
+    if isinstance(url_fetcher, PrefetchingURLFetcher):
+        # Prefetched resources are the ones of the wrapped url_fetcher.
+        url_fetcher = url_fetcher.url_fetcher
+    return (source_key, check_mime_type, device_media_type, base_url,
+            url_fetcher)
+
+
+def get_stylesheet(device_media_type, url_fetcher, url=None, string=None,
+                   base_url=None, check_mime_type=False):
+    """Return a :class:`CSS` object for ``url`` or ``string``.
+
+    Use :obj:`STYLESHEET_CACHE` if it is enabled.
+
+    """
+    cache = STYLESHEET_CACHE
+    if cache is not None:
+        if url is not None:
+            source_key = 'url', url
+        else:
+            string_bytes = (
+                string if isinstance(string, bytes)
+                else string.encode('utf-8'))
+            source_key = 'string', hashlib.sha1(string_bytes).hexdigest()
+        key = get_stylesheet_key(
+            source_key, check_mime_type, device_media_type, base_url,
+            url_fetcher)
+        css = cache.get(key)
+        if css is not None:
+            return css
+    css = CSS(url=url, string=string, base_url=base_url,
+              url_fetcher=url_fetcher, _check_mime_type=check_mime_type,
+              media_type=device_media_type)
+    if cache is not None:
+        cache[key] = css
+    return css
+
+
+def find_stylesheet_elements(element_tree, device_media_type):
+    """Yield the ``<style>`` and ``<link>`` stylesheet elements to use.
 
     The output order is the same as the source order.
 
@@ -177,43 +420,114 @@ def find_stylesheets(element_tree, device_media_type, url_fetcher):
         media = [media_type.strip() for media_type in media_attr.split(',')]
         if not evaluate_media_query(media, device_media_type):
             continue
+        if element.tag == 'style':
+            yield element
+        elif element.tag == 'link' and element.get('href'):
+            if not element_has_link_type(element, 'stylesheet') or \
+                    element_has_link_type(element, 'alternate'):
+                continue
+            yield element
+
+
+def find_stylesheets(element_tree, device_media_type, url_fetcher):
+    """Yield the stylesheets in ``element_tree``.
+
+    The output order is the same as the source order.
+
+    """
+    for element in find_stylesheet_elements(element_tree, device_media_type):
         if element.tag == 'style':
             # Content is text that is directly in the <style> element, not its
             # descendants
             content = get_child_text(element)
             # lxml should give us either unicode or ASCII-only bytestrings, so
             # we don't need `encoding` here.
-            css = CSS(string=content, base_url=element_base_url(element),
-                      url_fetcher=url_fetcher, media_type=device_media_type)
-            yield css
-        elif element.tag == 'link' and element.get('href'):
-            if not element_has_link_type(element, 'stylesheet') or \
-                    element_has_link_type(element, 'alternate'):
-                continue
+            yield get_stylesheet(
+                device_media_type, url_fetcher, string=content,
+                base_url=element_base_url(element))
+        else:
             href = get_url_attribute(element, 'href')
             if href is not None:
                 try:
-                    yield CSS(url=href, url_fetcher=url_fetcher,
-                              _check_mime_type=True,
-                              media_type=device_media_type)
+                    yield get_stylesheet(
+                        device_media_type, url_fetcher, url=href,
+                        check_mime_type=True)
                 except URLFetchingError as exc:
                     LOGGER.warning('Failed to load stylesheet at %s : %s',
                                    href, exc)
 
 
+def find_stylesheet_urls(element_tree, device_media_type, url_fetcher):
+    """Yield the URLs of the stylesheets that :func:`find_stylesheets` would
+    fetch, ignoring the ones in :obj:`STYLESHEET_CACHE`.
+
+    """
+    for element in find_stylesheet_elements(element_tree, device_media_type):
+        if element.tag == 'link':
+            href = get_url_attribute(element, 'href')
+            if href is not None and not (
+                    STYLESHEET_CACHE is not None and get_stylesheet_key(
+                        ('url', href), True, device_media_type, None,
+                        url_fetcher) in STYLESHEET_CACHE):
+                yield href
+
+
+def find_import_urls(device_media_type, base_url, rules, url_fetcher):
+    """Return the URLs of the stylesheets that the ``@import`` rules of
+    ``rules`` would fetch, ignoring the ones in :obj:`STYLESHEET_CACHE`.
+
+    """
+    urls = []
+    for rule in rules:
+        if rule.at_keyword != '@import' or not evaluate_media_query(
+                rule.media, device_media_type):
+            continue
+        if not (base_url or url_is_absolute(rule.uri)):
+            # preprocess_stylesheet() warns about this URL.
+            continue
+        url = url_join(base_url, rule.uri, '@import at %s:%s',
+                       rule.line, rule.column)
+        if not (STYLESHEET_CACHE is not None and get_stylesheet_key(
+                ('url', url), False, device_media_type, None,
+                url_fetcher) in STYLESHEET_CACHE):
+            urls.append(url)
+    return urls
+
+
 def find_style_attributes(element_tree):
     """
-    Yield ``element, declaration, base_url`` for elements with
-    a "style" attribute.
+    Yield ``element, declarations`` for elements with a "style" attribute.
+
+    ``declarations`` are preprocessed ``(name, values, importance)`` tuples.
+
     """
-    parser = PARSER
     for element in element_tree.iter():
         style_attribute = element.get('style')
         if style_attribute:
-            declarations, errors = parser.parse_style_attr(style_attribute)
-            for error in errors:
-                LOGGER.warning(error)
-            yield element, declarations, element_base_url(element)
+            yield element, get_style_attribute_declarations(
+                style_attribute, element_base_url(element))
+
+
+def get_style_attribute_declarations(style_attribute, base_url):
+    """Return the preprocessed declarations of a "style" attribute.
+
+    Results are kept in :obj:`STYLE_ATTRIBUTE_CACHE` for attributes without
+    errors, as the same attributes are often used many times.
+
+    """
+    key = style_attribute, base_url
+    declarations = STYLE_ATTRIBUTE_CACHE.get(key)
+    if declarations is None:
+        declarations, errors = PARSER.parse_style_attr(style_attribute)
+        for error in errors:
+            LOGGER.warning(error)
+        ignored = []
+        declarations = tuple(preprocess_declarations(
+            base_url, declarations, ignored))
+        if not errors and not ignored:
+            # Keep the warnings for each element with invalid declarations.
+            STYLE_ATTRIBUTE_CACHE[key] = declarations
+    return declarations
 
 
 def evaluate_media_query(query_list, device_media_type):
@@ -264,14 +578,81 @@ def add_declaration(cascaded_styles, prop_name, prop_values, weight, element,
         style[prop_name] = prop_values, weight
 
 
+class StyleSharingCache(object):
+    """Computed styles shared by elements with the same cascaded values.
+
+    Siblings (such as table rows, list items or table cells with the same
+    class) often have the same parent style and the same cascaded
+    declarations: their computed styles are the same, unless some values
+    depend on the element itself.
+
+    Keys rely on the identity of the parent styles and of the cascaded
+    values: a cache must only be used for a single cascade. The ``hits``
+    and ``misses`` attributes count the lookups.
+
+    """
+    def __init__(self):
+        self.styles = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, element, cascaded, parent_style, pseudo_type):
+        """Return the key for an element, or ``None`` if it can not share."""
+        if not isinstance(getattr(element, 'tag', None), basestring):
+            # @page styles are modified in place during the layout.
+            return None
+        if is_element_dependent(cascaded):
+            return None
+        return (id(parent_style), pseudo_type, frozenset(
+            (name, id(values)) for name, (values, _weight)
+            in iteritems(cascaded)))
+
+    def get(self, key):
+        style = self.styles.get(key)
+        if style is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return style
+
+    def __setitem__(self, key, style):
+        self.styles[key] = style
+
+
+def is_element_dependent(cascaded):
+    """Return whether computing ``cascaded`` values depends on the element.
+
+    This is the case with ``attr()`` values, read from the element
+    attributes.
+
+    """
+    if 'anchor' in cascaded and cascaded['anchor'][0] != 'none':
+        return True
+    for name in ('link', 'lang'):
+        if name in cascaded:
+            values = cascaded[name][0]
+            if values != 'none' and values[0] == 'attr':
+                return True
+    if 'content' in cascaded:
+        values = cascaded['content'][0]
+        if values not in ('normal', 'none') and any(
+                type_ == 'attr' for type_, _value in values):
+            return True
+    return False
+
+
 def set_computed_styles(cascaded_styles, computed_styles,
-                        element, parent, pseudo_type=None):
+                        element, parent, pseudo_type=None,
+                        sharing_cache=None):
     """Set the computed values of styles to ``element``.
 
     Take the properties left by ``apply_style_rule`` on an element or
     pseudo-element and assign computed values with respect to the cascade,
     declaration priority (ie. ``!important``) and selector specificity.
 
+    If ``sharing_cache`` is a :class:`StyleSharingCache`, reuse the style
+    computed for an element with the same parent style and cascaded values.
+
     """
     if parent is None:
         parent_style = None
@@ -279,26 +660,44 @@ def set_computed_styles(cascaded_styles, computed_styles,
         parent_style = computed_styles[parent, None]
 
     cascaded = cascaded_styles.get((element, pseudo_type), {})
+    key = None
+    if sharing_cache is not None:
+        key = sharing_cache.get_key(
+            element, cascaded, parent_style, pseudo_type)
+        if key is not None:
+            style = sharing_cache.get(key)
+            if style is not None:
+                computed_styles[element, pseudo_type] = style
+                return
     style = computed_from_cascaded(
         element, cascaded, parent_style, pseudo_type)
+    if key is not None:
+        sharing_cache[key] = style
     computed_styles[element, pseudo_type] = style
 
 
+class DefaultSpecified(object):
+    """Specified values of the properties with no cascaded value."""
+    def __init__(self, parent_style):
+        self.parent_style = parent_style
+
+    def __getitem__(self, name):
+        if name in properties.INHERITED:
+            return self.parent_style[name]
+        else:
+            return properties.INITIAL_VALUES[name]
+
+
 def computed_from_cascaded(element, cascaded, parent_style, pseudo_type=None):
     """Get a dict of computed style mixed from parent and cascaded styles."""
     if not cascaded and parent_style is not None:
         # Fast path for anonymous boxes:
         # no cascaded style, only implicitly initial or inherited values.
-        computed = StyleDict(parent=properties.INITIAL_VALUES)
-        for name in properties.INHERITED:
-            computed[name] = parent_style[name]
-        # border-*-style is none, so border-width computes to zero.
-        # Other than that, properties that would need computing are
-        # border-*-color, but they do not apply.
-        for side in ('top', 'bottom', 'left', 'right'):
-            computed['border_%s_width' % side] = 0
-        computed['outline_width'] = 0
-        return computed
+        return ComputedStyle.inheriting(parent_style)
+
+    if isinstance(parent_style, ComputedStyle):
+        return computed_from_parent(
+            element, cascaded, parent_style, pseudo_type)
 
     # Handle inheritance and initial values
     specified = StyleDict()
@@ -329,8 +728,64 @@ def computed_from_cascaded(element, cascaded, parent_style, pseudo_type=None):
 
         specified[name] = value
 
-    return computed_values.compute(
-        element, pseudo_type, specified, computed, parent_style)
+    return ComputedStyle.from_mapping(computed_values.compute(
+        element, pseudo_type, specified, computed, parent_style), parent_style)
+
+
+def computed_from_parent(element, cascaded, parent_style, pseudo_type=None):
+    """Get the computed style of an element that is not the root element.
+
+    Start from the style of an element with no cascaded value, sharing the
+    inherited values of ``parent_style``, and only compute the cascaded
+    values and the values depending on them.
+
+    """
+    style = ComputedStyle.inheriting(parent_style)
+    specified = {}
+    names = set()
+    for name, (value, _precedence) in iteritems(cascaded):
+        if value == 'initial':
+            value = properties.INITIAL_VALUES[name]
+            if RE_INITIAL_NOT_COMPUTED(name):
+                names.add(name)
+            else:
+                # The value is the same as when computed
+                style[name] = value
+        elif value == 'inherit':
+            value = parent_style[name]
+            # Values in parent_style are already computed.
+            if style[name] is not value:
+                style[name] = value
+        else:
+            names.add(name)
+        specified[name] = value
+
+    # Values depending on other specified or computed values.
+    dependencies = []
+    for side in ('top', 'bottom', 'left', 'right'):
+        if 'border_%s_style' % side in cascaded:
+            dependencies.append('border_%s_width' % side)
+    if 'outline_style' in cascaded:
+        dependencies.append('outline_width')
+    if 'position' in cascaded:
+        dependencies.append('float')
+    if ('float' in cascaded or 'position' in cascaded or
+            getattr(element, 'getparent', lambda: None)() is None):
+        # The root element, @page and their pseudo-elements are blockified.
+        dependencies.append('display')
+    for name in dependencies:
+        if name not in cascaded:
+            names.add(name)
+
+    if 'display' in specified and 'display' not in names:
+        style['_weasy_specified_display'] = specified['display']
+
+    if names:
+        computed_values.compute(
+            element, pseudo_type,
+            StyleDict(specified, parent=DefaultSpecified(parent_style)),
+            style, parent_style, names)
+    return style
 
 
 class Selector(object):
@@ -340,12 +795,266 @@ class Selector(object):
         self.match = match
 
 
+class ElementSelector(Selector):
+    """A selector for elements, that can be put in a :class:`RuleIndex`.
+
+    :param key:
+        The index key of the rightmost compound selector, as returned by
+        :func:`get_selector_key`.
+    :param xpath:
+        An XPath expression testing whether an element matches, or ``None``
+        if all the elements with ``key`` match. It is compiled into the
+        ``element_match`` function.
+    :raises: :exc:`ValueError` if the expression can not be compiled.
+
+    """
+    def __init__(self, specificity, pseudo_element, key, xpath):
+        self.specificity = specificity
+        self.pseudo_element = pseudo_element
+        self.key = key
+        self.xpath = xpath
+        self.element_match = (
+            None if xpath is None else lxml.etree.XPath(xpath))
+
+    def __getstate__(self):
+        # Compiled XPath expressions can not be pickled.
+        state = self.__dict__.copy()
+        del state['element_match']
+        return state
+
+    def __setstate__(self, state):
+        self.__init__(
+            state['specificity'], state['pseudo_element'], state['key'],
+            state['xpath'])
+
+    def match(self, element_tree):
+        """Yield the elements matching this selector, in tree order."""
+        element_match = self.element_match
+        for element in element_tree.iter():
+            if self.key in element_keys(element) and (
+                    element_match is None or element_match(element)):
+                yield element
+
+
+# XPath axes from an element to the elements on the left of a combinator.
+COMBINATOR_AXES = {
+    ' ': 'ancestor::',
+    '>': 'parent::',
+    '+': 'preceding-sibling::*[1]/self::',
+    '~': 'preceding-sibling::',
+}
+
+# Whitespace as in the normalize-space() XPath function used for classes.
+split_classes = re.compile('[ \t\r\n]+').split
+
+
+def get_selector_key(tree):
+    """Return the index key of the rightmost compound selector of ``tree``.
+
+    Keys are ``('id', id)``, ``('class', class_name)``,
+    ``('attribute', name)``, ``('tag', name)`` or ``None`` for selectors
+    that may match any element. The most selective key is used.
+
+    """
+    if isinstance(tree, cssselect.parser.CombinedSelector):
+        tree = tree.subselector
+    key = None
+    while not isinstance(tree, cssselect.parser.Element):
+        if isinstance(tree, cssselect.parser.Hash):
+            return 'id', tree.id
+        elif isinstance(tree, cssselect.parser.Class):
+            key = 'class', tree.class_name
+        elif (isinstance(tree, cssselect.parser.Attrib) and
+                tree.namespace is None and tree.operator != '!=' and
+                (key is None or key[0] != 'class')):
+            # [name!=value] also matches elements without the attribute.
+            key = 'attribute', tree.attrib.lower()
+        tree = tree.selector
+    if key is None and tree.namespace is None and tree.element not in (
+            None, '*'):
+        key = 'tag', tree.element.lower()
+    return key
+
+
+def element_keys(element):
+    """Return the index keys matching ``element``, ``None`` included."""
+    tag = element.tag
+    if not isinstance(tag, basestring):
+        # Comments and processing instructions are not matched.
+        return ()
+    keys = [None, ('tag', tag)]
+    keys.extend(('attribute', name) for name in element.keys())
+    element_id = element.get('id')
+    if element_id is not None:
+        keys.append(('id', element_id))
+    classes = element.get('class')
+    if classes:
+        keys.extend(set(
+            ('class', class_name) for class_name in split_classes(classes)
+            if class_name))
+    return keys
+
+
+def selector_to_element_xpath(translator, tree):
+    """Return an XPath expression testing an element against ``tree``.
+
+    The expression is a relative location path, whose context node is the
+    tested element. Combinators are translated into predicates on the axes
+    going back from the element, instead of paths going down from the root.
+
+    """
+    if isinstance(tree, cssselect.parser.CombinedSelector):
+        return '%s[%s%s]' % (
+            selector_to_element_xpath(translator, tree.subselector),
+            COMBINATOR_AXES[tree.combinator],
+            selector_to_element_xpath(translator, tree.selector))
+    expression = translator.xpath(tree)
+    if expression.condition:
+        return '%s[%s]' % (expression.element, expression.condition)
+    return expression.element
+
+
+def is_key_selector(tree):
+    """Return whether all the elements with the index key of ``tree`` match.
+
+    This is the case of type, universal, id and class selectors alone.
+
+    """
+    if isinstance(tree, (cssselect.parser.Hash, cssselect.parser.Class)):
+        tree = tree.selector
+        return (
+            isinstance(tree, cssselect.parser.Element) and
+            tree.namespace is None and tree.element in (None, '*'))
+    return (
+        isinstance(tree, cssselect.parser.Element) and tree.namespace is None)
+
+
+def compile_selector(translator, selector):
+    """Return an :class:`ElementSelector` for a parsed cssselect selector."""
+    tree = selector.parsed_tree
+    key = get_selector_key(tree)
+    if is_key_selector(tree):
+        xpath = None
+    else:
+        xpath = 'boolean(self::%s)' % selector_to_element_xpath(
+            translator, tree)
+    try:
+        return ElementSelector(
+            (0,) + selector.specificity(), selector.pseudo_element, key,
+            xpath)
+    except ValueError as exc:
+        # TODO: Some characters are not supported by lxml's
+        # XPath implementation (including control
+        # characters), but these characters are valid in
+        # the CSS2.1 specification.
+        raise cssselect.SelectorError(str(exc))
+
+
+class RuleIndex(object):
+    """Element selectors with their declarations, indexed by key.
+
+    Each element is only tested against the selectors whose key it has,
+    instead of querying the whole document once for each selector.
+
+    """
+    def __init__(self):
+        self.rules = {}
+        self.length = 0
+
+    def add(self, selector, declarations, stats=None):
+        """Add a selector and its weighted declarations.
+
+        ``declarations`` is a list of ``(name, values, weight)``. Rules are
+        kept in the order they are added: when weights are equal, the
+        declarations of the last rules win. ``stats`` is an optional
+        :class:`SelectorStats` object, given back by :meth:`get_candidates`.
+
+        """
+        self.rules.setdefault(selector.key, []).append((
+            self.length, selector.element_match, selector.pseudo_element,
+            declarations, stats))
+        self.length += 1
+
+    def get_candidates(self, element):
+        """Return the rules that may match ``element``, in the order they
+        were added.
+
+        Rules are ``(order, element_match, pseudo_type, declarations, stats)``
+        tuples. ``element_match`` is :obj:`None` for rules that always match.
+
+        """
+        candidates = []
+        rules = self.rules
+        for key in element_keys(element):
+            if key in rules:
+                candidates.extend(rules[key])
+        candidates.sort()
+        return candidates
+
+    def get_rules(self, element):
+        """Return the rules matching ``element``, in the order they were added.
+
+        Rules are ``(pseudo_type, declarations)`` tuples.
+
+        """
+        return [
+            (pseudo_type, declarations)
+            for _order, element_match, pseudo_type, declarations, _stats
+            in self.get_candidates(element)
+            if element_match is None or element_match(element)]
+
+
+def get_selector_list(selector_string):
+    """Return a list of :class:`ElementSelector` for a group of selectors.
+
+    Compiled selectors are kept in :obj:`SELECTOR_CACHE` and shared by all
+    the stylesheets.
+
+    :raises: :class:`cssselect.SelectorError` for invalid or unsupported
+             selectors.
+
+    """
+    result = SELECTOR_CACHE.get(selector_string)
+    if result is None:
+        try:
+            result = tuple(
+                compile_selector(TRANSLATOR, selector)
+                for selector in cssselect.parse(selector_string))
+            for selector in result:
+                if selector.pseudo_element not in PSEUDO_ELEMENTS:
+                    raise cssselect.ExpressionError(
+                        'Unknown pseudo-element: %s'
+                        % selector.pseudo_element)
+        except cssselect.SelectorError as exc:
+            # Don't keep the exception and its traceback around.
+            result = type(exc), exc.args
+            SELECTOR_CACHE[selector_string] = result
+            raise
+        SELECTOR_CACHE[selector_string] = result
+    if result and isinstance(result[0], type):
+        exception_type, args = result
+        raise exception_type(*args)
+    return list(result)
+
+
+def match_page_types(page_types, _document):
+    """Return the page types of an ``@page`` selector."""
+    return page_types
+
+
 def preprocess_stylesheet(device_media_type, base_url, rules, url_fetcher):
     """Do the work that can be done early on stylesheet, before they are
     in a document.
 
+    If ``url_fetcher`` has a ``prefetch`` method, like
+    :class:`urls.PrefetchingURLFetcher`, it is given the URLs of all the
+    stylesheets imported by ``rules`` before the first one is used.
+
     """
-    selector_to_xpath = cssselect.HTMLTranslator().selector_to_xpath
+    prefetch = getattr(url_fetcher, 'prefetch', None)
+    if prefetch is not None:
+        prefetch(find_import_urls(
+            device_media_type, base_url, rules, url_fetcher))
     for rule in rules:
         if not rule.at_keyword:
             declarations = list(preprocess_declarations(
@@ -353,25 +1062,7 @@ def preprocess_stylesheet(device_media_type, base_url, rules, url_fetcher):
             if declarations:
                 selector_string = rule.selector.as_css()
                 try:
-                    selector_list = []
-                    for selector in cssselect.parse(selector_string):
-                        xpath = selector_to_xpath(selector)
-                        try:
-                            lxml_xpath = lxml.etree.XPath(xpath)
-                        except ValueError as exc:
-                            # TODO: Some characters are not supported by lxml's
-                            # XPath implementation (including control
-                            # characters), but these characters are valid in
-                            # the CSS2.1 specification.
-                            raise cssselect.SelectorError(str(exc))
-                        selector_list.append(Selector(
-                            (0,) + selector.specificity(),
-                            selector.pseudo_element, lxml_xpath))
-                    for selector in selector_list:
-                        if selector.pseudo_element not in PSEUDO_ELEMENTS:
-                            raise cssselect.ExpressionError(
-                                'Unknown pseudo-element: %s'
-                                % selector.pseudo_element)
+                    selector_list = get_selector_list(selector_string)
                 except cssselect.SelectorError as exc:
                     LOGGER.warning("Invalid or unsupported selector '%s', %s",
                                    selector_string, exc)
@@ -385,8 +1076,8 @@ def preprocess_stylesheet(device_media_type, base_url, rules, url_fetcher):
                            rule.line, rule.column)
             if url is not None:
                 try:
-                    stylesheet = CSS(url=url, url_fetcher=url_fetcher,
-                                     media_type=device_media_type)
+                    stylesheet = get_stylesheet(
+                        device_media_type, url_fetcher, url=url)
                 except URLFetchingError as exc:
                     LOGGER.warning('Failed to load stylesheet at %s : %s',
                                    url, exc)
@@ -412,9 +1103,9 @@ def preprocess_stylesheet(device_media_type, base_url, rules, url_fetcher):
             declarations = list(preprocess_declarations(
                 base_url, rule.declarations))
 
-            # Use a double lambda to have a closure that holds page_types
-            match = (lambda page_types: lambda _document: page_types)(
-                PAGE_PSEUDOCLASS_TARGETS[pseudo_class])
+            # Use a partial function that holds page_types and can be pickled
+            match = functools.partial(
+                match_page_types, PAGE_PSEUDOCLASS_TARGETS[pseudo_class])
             specificity = rule.specificity
 
             if declarations:
@@ -430,7 +1121,169 @@ def preprocess_stylesheet(device_media_type, base_url, rules, url_fetcher):
                     yield margin_rule, selector_list, declarations
 
 
-def get_all_computed_styles(html, user_stylesheets=None):
+def get_selector_texts(rule):
+    """Return the source of each selector of a rule, as a list of strings."""
+    if rule.at_keyword is None:
+        # Split the group of selectors on top-level commas. Commas in
+        # functions such as :not() are in container tokens.
+        texts = ['']
+        for token in rule.selector:
+            if token.type == 'DELIM' and token.value == ',':
+                texts.append('')
+            else:
+                texts[-1] += token.as_css()
+        return [text.strip() for text in texts]
+    elif rule.at_keyword == '@page':
+        _page_name, pseudo_class = rule.selector
+        return ['@page' + (':' + pseudo_class if pseudo_class else '')]
+    else:
+        return [rule.at_keyword]
+
+
+class SelectorStats(object):
+    """Counters and timings of a selector, collected by
+    :class:`CascadeProfiler`.
+
+    """
+    def __init__(self, origin, base_url, line, column, selector, specificity,
+                 declarations):
+        self.origin = origin
+        self.base_url = base_url
+        self.line = line
+        self.column = column
+        self.selector = selector
+        self.specificity = specificity
+        self.declarations = declarations
+        self.tested = 0
+        self.matched = 0
+        self.time = 0
+
+    def to_dict(self, applied):
+        matched_declarations = self.matched * self.declarations
+        return {
+            'origin': self.origin,
+            'base_url': self.base_url,
+            'line': self.line,
+            'column': self.column,
+            'selector': self.selector,
+            'specificity': self.specificity,
+            'tested': self.tested,
+            'matched': self.matched,
+            'time': self.time,
+            'declarations': matched_declarations,
+            'applied': applied,
+            'overridden': matched_declarations - applied,
+        }
+
+
+class CascadeProfiler(object):
+    """Timings and counters of the cascade, per phase and per selector.
+
+    Give a new profiler to :func:`get_all_computed_styles`, then call
+    :meth:`report`. Profiling makes the cascade slower: timings are only
+    meant to be compared with each other.
+
+    """
+    def __init__(self, timer=timeit.default_timer):
+        self.timer = timer
+        self.phases = []
+        self.selectors = []
+        # keys: (element, pseudo_type, property name)
+        # values: the SelectorStats of the winning declaration, or None
+        self.winners = {}
+        self._last_time = None
+
+    def start(self):
+        self._last_time = self.timer()
+
+    def end_phase(self, name):
+        """Record the time spent since the previous phase."""
+        now = self.timer()
+        self.phases.append((name, now - self._last_time))
+        self._last_time = now
+
+    def add_time(self, name, seconds):
+        """Add time to a phase, recorded if needed."""
+        for i, (phase_name, phase_time) in enumerate(self.phases):
+            if phase_name == name:
+                self.phases[i] = name, phase_time + seconds
+                break
+        else:
+            self.phases.append((name, seconds))
+
+    def add_selector(self, origin, sheet, rule, selector_list, declarations):
+        """Return a :class:`SelectorStats` for each selector of a rule."""
+        texts = get_selector_texts(rule)
+        if len(texts) != len(selector_list):
+            texts = [', '.join(texts)] * len(selector_list)
+        stats_list = [
+            SelectorStats(
+                origin, sheet.base_url, rule.line, rule.column, text,
+                selector.specificity, len(declarations))
+            for selector, text in zip(selector_list, texts)]
+        self.selectors.extend(stats_list)
+        return stats_list
+
+    def match(self, candidates, element):
+        """Like :meth:`RuleIndex.get_rules`, recording the match times."""
+        timer = self.timer
+        for _order, element_match, pseudo_type, declarations, stats in (
+                candidates):
+            start = timer()
+            matched = element_match is None or element_match(element)
+            stats.time += timer() - start
+            stats.tested += 1
+            if matched:
+                stats.matched += 1
+                yield pseudo_type, declarations, stats
+
+    def add_declaration(self, cascaded_styles, prop_name, prop_values, weight,
+                        element, pseudo_type=None, stats=None):
+        """Like :func:`add_declaration`, recording the winning selector.
+
+        ``stats`` is :obj:`None` for declarations in style attributes.
+
+        """
+        add_declaration(cascaded_styles, prop_name, prop_values, weight,
+                        element, pseudo_type)
+        if cascaded_styles[element, pseudo_type][prop_name][1] is weight:
+            self.winners[element, pseudo_type, prop_name] = stats
+
+    def report(self):
+        """Return the collected data.
+
+        The result is a dict with these keys:
+
+        ``phases``
+            A list of ``(name, seconds)`` tuples, in the order of the cascade:
+            ``'stylesheets'``, ``'rules'``, ``'matching'``,
+            ``'style attributes'``, ``'computed values'`` and
+            ``'pseudo-elements'``. Most pseudo-element styles are computed
+            when they are first requested, so the last phase includes time
+            spent after the cascade, typically while building boxes.
+
+        ``selectors``
+            A list of dicts, one per selector, slowest first, with the
+            ``origin``, ``base_url``, ``line``, ``column``, ``selector`` and
+            ``specificity`` of the selector, the number of elements or pages
+            it was ``tested`` against and has ``matched``, the ``time``
+            spent matching in seconds, and the number of ``declarations``
+            set by the selector, split into the ones ``applied`` in the
+            cascaded values and the ones ``overridden`` by other declarations.
+
+        """
+        applied = {}
+        for stats in self.winners.values():
+            applied[id(stats)] = applied.get(id(stats), 0) + 1
+        selectors = [
+            stats.to_dict(applied.get(id(stats), 0))
+            for stats in self.selectors]
+        selectors.sort(key=lambda stats: stats['time'], reverse=True)
+        return {'phases': list(self.phases), 'selectors': selectors}
+
+
+def get_all_computed_styles(html, user_stylesheets=None, sharing_cache=None,
+                            profiler=None, url_fetcher=None):
     """Compute all the computed styles of all elements
     in the given ``html`` document.
 
@@ -439,13 +1292,29 @@ def get_all_computed_styles(html, user_stylesheets=None):
     Return a ``style_for`` function that takes an element and an optional
     pseudo-element type, and return a StyleDict object.
 
+    :param sharing_cache:
+        A new :class:`StyleSharingCache`, or :obj:`None` to use a private
+        one. Elements with the same cascaded values share their style.
+    :param profiler:
+        A new :class:`CascadeProfiler`, or :obj:`None` to disable profiling.
+    :param url_fetcher:
+        The url_fetcher used for stylesheets, defaults to the one of
+        ``html``.
+
     """
+    if sharing_cache is None:
+        sharing_cache = StyleSharingCache()
+    if profiler is not None:
+        profiler.start()
     element_tree = html.root_element
     device_media_type = html.media_type
-    url_fetcher = html.url_fetcher
+    if url_fetcher is None:
+        url_fetcher = html.url_fetcher
     ua_stylesheets = html._ua_stylesheets()
     author_stylesheets = list(find_stylesheets(
         element_tree, device_media_type, url_fetcher))
+    if profiler is not None:
+        profiler.end_phase('stylesheets')
 
     # keys: (element, pseudo_element_type)
     #    element: a lxml element object or the '@page' string for @page styles
@@ -458,6 +1327,7 @@ def get_all_computed_styles(html, user_stylesheets=None):
     #         weight: values with a greater weight take precedence, see
     #             http://www.w3.org/TR/CSS21/cascade.html#cascading-order
     cascaded_styles = {}
+    rule_index = RuleIndex()
 
     for sheets, origin in (
         # Order here is not important ('origin' is).
@@ -467,26 +1337,71 @@ def get_all_computed_styles(html, user_stylesheets=None):
         (user_stylesheets or [], 'user'),
     ):
         for sheet in sheets:
-            for _rule, selector_list, declarations in sheet.rules:
-                for selector in selector_list:
+            for rule, selector_list, declarations in sheet.rules:
+                if profiler is None:
+                    stats_list = [None] * len(selector_list)
+                else:
+                    stats_list = profiler.add_selector(
+                        origin, sheet, rule, selector_list, declarations)
+                for selector, stats in zip(selector_list, stats_list):
                     specificity = selector.specificity
+                    weighted_declarations = [
+                        (name, values, (
+                            declaration_precedence(origin, importance),
+                            specificity))
+                        for name, values, importance in declarations]
+                    if isinstance(selector, ElementSelector):
+                        rule_index.add(selector, weighted_declarations, stats)
+                        continue
+                    # @page rules
                     pseudo_type = selector.pseudo_element
-                    for element in selector.match(element_tree):
-                        for name, values, importance in declarations:
-                            precedence = declaration_precedence(
-                                origin, importance)
-                            weight = (precedence, specificity)
-                            add_declaration(
-                                cascaded_styles, name, values, weight,
-                                element, pseudo_type)
+                    for page_type in selector.match(element_tree):
+                        if profiler is not None:
+                            stats.tested += 1
+                            stats.matched += 1
+                        for name, values, weight in weighted_declarations:
+                            if profiler is None:
+                                add_declaration(
+                                    cascaded_styles, name, values, weight,
+                                    page_type, pseudo_type)
+                            else:
+                                profiler.add_declaration(
+                                    cascaded_styles, name, values, weight,
+                                    page_type, pseudo_type, stats)
+    if profiler is not None:
+        profiler.end_phase('rules')
+
+    # Match all the element selectors in a single walk of the tree.
+    if profiler is None:
+        for element in element_tree.iter():
+            for pseudo_type, declarations in rule_index.get_rules(element):
+                for name, values, weight in declarations:
+                    add_declaration(
+                        cascaded_styles, name, values, weight, element,
+                        pseudo_type)
+    else:
+        for element in element_tree.iter():
+            for pseudo_type, declarations, stats in profiler.match(
+                    rule_index.get_candidates(element), element):
+                for name, values, weight in declarations:
+                    profiler.add_declaration(
+                        cascaded_styles, name, values, weight, element,
+                        pseudo_type, stats)
+        profiler.end_phase('matching')
 
     specificity = (1, 0, 0, 0)
-    for element, declarations, base_url in find_style_attributes(element_tree):
-        for name, values, importance in preprocess_declarations(
-                base_url, declarations):
+    for element, declarations in find_style_attributes(element_tree):
+        for name, values, importance in declarations:
             precedence = declaration_precedence('author', importance)
             weight = (precedence, specificity)
-            add_declaration(cascaded_styles, name, values, weight, element)
+            if profiler is None:
+                add_declaration(
+                    cascaded_styles, name, values, weight, element)
+            else:
+                profiler.add_declaration(
+                    cascaded_styles, name, values, weight, element)
+    if profiler is not None:
+        profiler.end_phase('style attributes')
 
     # keys: (element, pseudo_element_type), like cascaded_styles
     # values: StyleDict objects:
@@ -501,7 +1416,8 @@ def get_all_computed_styles(html, user_stylesheets=None):
     # Iterate on all elements, even if there is no cascaded style for them.
     for element in element_tree.iter():
         set_computed_styles(cascaded_styles, computed_styles, element,
-                            parent=element.getparent())
+                            parent=element.getparent(),
+                            sharing_cache=sharing_cache)
 
     # Then computed styles for @page.
 
@@ -513,27 +1429,36 @@ def get_all_computed_styles(html, user_stylesheets=None):
             # @page inherits from the root element:
             # http://lists.w3.org/Archives/Public/www-style/2012Jan/1164.html
             parent=element_tree)
+    if profiler is not None:
+        profiler.end_phase('computed values')
 
-    # Then computed styles for pseudo elements, in any order.
-    # Pseudo-elements inherit from their associated element so they come
-    # last. Do them in a second pass as there is no easy way to iterate
-    # on the pseudo-elements for a given element with the current structure
-    # of cascaded_styles. (Keys are (element, pseudo_type) tuples.)
+    # Then computed styles for pseudo elements, on demand.
+    # Pseudo-elements inherit from their associated element, whose style is
+    # already computed. Many pseudo-elements (such as ::first-letter matched
+    # by broad selectors) never generate boxes: only compute the styles that
+    # are requested, and keep them for the next calls.
 
-    # Only iterate on pseudo-elements that have cascaded styles. (Others
+    # Only pseudo-elements that have cascaded styles get a style. (Others
     # might as well not exist.)
-    for element, pseudo_type in cascaded_styles:
-        if pseudo_type:
-            set_computed_styles(cascaded_styles, computed_styles,
-                                element, pseudo_type=pseudo_type,
-                                # The pseudo-element inherits from the element.
-                                parent=element)
+    if profiler is not None:
+        profiler.end_phase('pseudo-elements')
 
-    # This is mostly useful to make pseudo_type optional.
     def style_for(element, pseudo_type=None, __get=computed_styles.get):
         """
         Convenience function to get the computed styles for an element.
         """
-        return __get((element, pseudo_type))
+        style = __get((element, pseudo_type))
+        if style is None and pseudo_type and (
+                (element, pseudo_type) in cascaded_styles):
+            if profiler is not None:
+                start = profiler.timer()
+            set_computed_styles(cascaded_styles, computed_styles,
+                                element, pseudo_type=pseudo_type,
+                                # The pseudo-element inherits from the element.
+                                parent=element, sharing_cache=sharing_cache)
+            if profiler is not None:
+                profiler.add_time('pseudo-elements', profiler.timer() - start)
+            style = computed_styles[element, pseudo_type]
+        return style
 
     return style_for
@@ -15,6 +15,7 @@ from __future__ import division, unicode_literals
 
 from .properties import INITIAL_VALUES, Dimension
 from ..urls import get_link_attribute
+from ..lru import LRUCache
 from .. import text
 
 
@@ -130,6 +131,11 @@ INITIAL_PAGE_SIZE = PAGE_SIZES['a4']
 INITIAL_VALUES['size'] = tuple(
     d.value * LENGTHS_TO_PIXELS[d.unit] for d in INITIAL_PAGE_SIZE)
 
+# Results of strut_layout() and ex_ratio(). They only depend on the font
+# properties, line-height and hinting, not on the element.
+STRUT_LAYOUT_CACHE = LRUCache(maxsize=1024)
+EX_RATIO_CACHE = LRUCache(maxsize=256)
+
 
 def _computing_order():
     """Some computed values are required by others, so order matters."""
@@ -141,6 +147,7 @@ def _computing_order():
         order.remove(name)
     return tuple(first + order)
 COMPUTING_ORDER = _computing_order()
+COMPUTING_INDEXES = dict((name, i) for i, name in enumerate(COMPUTING_ORDER))
 
 # Maps property names to functions returning the computed values
 COMPUTER_FUNCTIONS = {}
@@ -157,7 +164,8 @@ def register_computer(name):
     return decorator
 
 
-def compute(element, pseudo_type, specified, computed, parent_style):
+def compute(element, pseudo_type, specified, computed, parent_style,
+            names=None):
     """
     Return a StyleDict of computed values.
 
@@ -170,6 +178,8 @@ def compute(element, pseudo_type, specified, computed, parent_style):
     :param parent_values: a :class:`StyleDict` of computed values of the parent
                           element (should contain values for all properties),
                           or ``None`` if ``element`` is the root element.
+    :param names: if not ``None``, the set of the properties to compute.
+                  Other values are already in ``computed``.
     """
     if parent_style is None:
         parent_style = INITIAL_VALUES
@@ -183,11 +193,14 @@ def compute(element, pseudo_type, specified, computed, parent_style):
 
     getter = COMPUTER_FUNCTIONS.get
 
-    for name in COMPUTING_ORDER:
-        if name in computed:
-            # Already computed
-            continue
+    if names is None:
+        names = [name for name in COMPUTING_ORDER if name not in computed]
+        specified_display = True
+    else:
+        specified_display = 'display' in names
+        names = sorted(names, key=COMPUTING_INDEXES.__getitem__)
 
+    for name in names:
         value = specified[name]
         function = getter(name)
         if function is not None:
@@ -196,7 +209,8 @@ def compute(element, pseudo_type, specified, computed, parent_style):
 
         computed[name] = value
 
-    computed['_weasy_specified_display'] = specified.display
+    if specified_display:
+        computed['_weasy_specified_display'] = specified.display
     return computed
 
 
@@ -282,7 +296,6 @@ def length(computer, name, value, font_size=None, pixels_only=False):
         if font_size is None:
             font_size = computer.computed.font_size
         if unit == 'ex':
-            # TODO: cache
             result = value.value * font_size * ex_ratio(computer.computed)
         elif unit == 'ch':
             # TODO: cache
@@ -292,6 +305,7 @@ def length(computer, name, value, font_size=None, pixels_only=False):
             layout.set_text('0')
             line, = layout.iter_lines()
             logical_width, _ = text.get_size(line)
+            layout.release()
             result = value.value * logical_width
         elif unit == 'em':
             result = value.value * font_size
@@ -520,29 +534,44 @@ def strut_layout(style, hinting=True):
     The baseline is given from the top edge of line height.
 
     """
-    # TODO: cache these results for a given set of styles?
+    hinting = bool(hinting)
+    key = text.font_key(style, style.font_size) + (style.line_height, hinting)
+    result = STRUT_LAYOUT_CACHE.get(key)
+    if result is not None:
+        return result
     line_height = style.line_height
     if style.font_size == 0:
         pango_height = baseline = 0
     else:
         # TODO: get the real value for `hinting`? (if we really care…)
-        _, _, _, _, pango_height, baseline = text.split_first_line(
+        layout, _, _, _, pango_height, baseline = text.split_first_line(
             '', style, hinting=hinting, max_width=None, line_width=None)
+        layout.release()
     if line_height == 'normal':
-        return pango_height, baseline
-    type_, value = line_height
-    if type_ == 'NUMBER':
-        value *= style.font_size
-    return value, baseline + (value - pango_height) / 2
+        result = pango_height, baseline
+    else:
+        type_, value = line_height
+        if type_ == 'NUMBER':
+            value *= style.font_size
+        result = value, baseline + (value - pango_height) / 2
+    STRUT_LAYOUT_CACHE[key] = result
+    return result
 
 
 def ex_ratio(style):
     """Return the ratio 1ex/font_size, according to given style."""
     font_size = 1000  # big value
+    key = text.font_key(style, font_size)
+    ratio = EX_RATIO_CACHE.get(key)
+    if ratio is not None:
+        return ratio
     layout = text.Layout(hinting=False, font_size=font_size, style=style)
     layout.set_text('x')
     line, = layout.iter_lines()
     _, ink_height_above_baseline = text.get_ink_position(line)
+    layout.release()
     # Zero means some kind of failure, fallback is 0.5.
     # We round to try keeping exact values that were altered by Pango.
-    return round(-ink_height_above_baseline / font_size, 5) or 0.5
+    ratio = round(-ink_height_above_baseline / font_size, 5) or 0.5
+    EX_RATIO_CACHE[key] = ratio
+    return ratio
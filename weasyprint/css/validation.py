@@ -1787,11 +1787,12 @@ def validate_non_shorthand(base_url, name, tokens, required=False):
     return [(name, value)]
 
 
-def preprocess_declarations(base_url, declarations):
+def preprocess_declarations(base_url, declarations, ignored=None):
     """
     Expand shorthand properties and filter unsupported properties and values.
 
-    Log a warning for every ignored declaration.
+    Log a warning for every ignored declaration. If ``ignored`` is a list,
+    also append ignored declarations to it.
 
     Return a iterable of ``(name, value, priority)`` tuples.
 
@@ -1801,6 +1802,8 @@ def preprocess_declarations(base_url, declarations):
             'Ignored `%s: %s` at %i:%i, %s.',
             declaration.name, declaration.value.as_css(),
             declaration.line, declaration.column, reason)
+        if ignored is not None:
+            ignored.append(declaration)
 
     for declaration in declarations:
         name = declaration.name
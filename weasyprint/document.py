@@ -21,15 +21,17 @@ import cairocffi as cairo
 from . import CSS
 from . import images
 from .logger import LOGGER
-from .css import get_all_computed_styles
+from .cache import ResourceCache
+from .css import get_all_computed_styles, find_stylesheet_urls
 from .formatting_structure import boxes
 from .formatting_structure.build import build_formatting_structure
 from .layout import layout_document
 from .layout.backgrounds import percentage
 from .draw import draw_page, stacked
+from .html import find_resource_urls
 from .pdf import write_pdf_metadata
 from .compat import izip, iteritems, unicode
-from .urls import FILESYSTEM_ENCODING
+from .urls import FILESYSTEM_ENCODING, PrefetchingURLFetcher
 
 
 def _get_matrix(box):
@@ -309,16 +311,34 @@ class Document(object):
     """
     @classmethod
     def _render(cls, html, stylesheets, enable_hinting):
-        style_for = get_all_computed_styles(html, user_stylesheets=[
-            css if hasattr(css, 'rules')
-            else CSS(guess=css, media_type=html.media_type)
-            for css in stylesheets or []])
-        get_image_from_uri = functools.partial(
-            images.get_image_from_uri, {}, html.url_fetcher)
-        page_boxes = layout_document(
-            enable_hinting, style_for, get_image_from_uri,
-            build_formatting_structure(
-                html.root_element, style_for, get_image_from_uri))
+        url_fetcher = html.url_fetcher
+        prefetcher = None
+        if html.prefetch_concurrency:
+            url_fetcher = prefetcher = PrefetchingURLFetcher(
+                html.url_fetcher, html.prefetch_concurrency)
+            prefetcher.prefetch(find_stylesheet_urls(
+                html.root_element, html.media_type, html.url_fetcher))
+        try:
+            style_for = get_all_computed_styles(html, user_stylesheets=[
+                css if hasattr(css, 'rules')
+                else CSS(guess=css, media_type=html.media_type)
+                for css in stylesheets or []], url_fetcher=url_fetcher)
+            if prefetcher is not None:
+                prefetcher.prefetch(
+                    find_resource_urls(html.root_element, style_for))
+            if isinstance(html.url_fetcher, ResourceCache):
+                image_cache = html.url_fetcher.image_cache()
+            else:
+                image_cache = {}
+            get_image_from_uri = functools.partial(
+                images.get_image_from_uri, image_cache, url_fetcher)
+            page_boxes = layout_document(
+                enable_hinting, style_for, get_image_from_uri,
+                build_formatting_structure(
+                    html.root_element, style_for, get_image_from_uri))
+        finally:
+            if prefetcher is not None:
+                prefetcher.close()
         return cls([Page(p, enable_hinting) for p in page_boxes],
                    DocumentMetadata(**html._get_metadata()), html.url_fetcher)
 
@@ -861,6 +861,8 @@ def draw_text(context, textbox, enable_hinting):
     context.set_source_rgba(*textbox.style.color)
     show_first_line(context, textbox.pango_layout, enable_hinting)
     values = textbox.style.text_decoration
+    if values == 'none' or not values:
+        return
 
     metrics = textbox.pango_layout.get_font_metrics()
     thickness = textbox.style.font_size / 18  # That's what other browsers do
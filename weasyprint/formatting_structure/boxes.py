@@ -63,6 +63,7 @@ import itertools
 
 from ..compat import xrange
 from ..css.computed_values import ZERO_PIXELS
+from ..text import TextRun
 
 
 # The *Box classes have many attributes and methods, but that's the way it is
@@ -457,6 +458,13 @@ class TextBox(InlineLevelBox):
         new_box.text = text
         return new_box
 
+    def text_run(self):
+        """Return a :class:`text.TextRun` for the text of the box."""
+        text_run = self.__dict__.get('_text_run')
+        if text_run is None or text_run.text is not self.text:
+            text_run = self._text_run = TextRun(self.text)
+        return text_run
+
 
 class AtomicInlineLevelBox(InlineLevelBox):
     """An atomic box in an inline formatting context.
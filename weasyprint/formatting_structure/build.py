@@ -56,10 +56,9 @@ def build_formatting_structure(element_tree, style_for, get_image_from_uri):
         def root_style_for(element, pseudo_type=None):
             style = style_for(element, pseudo_type)
             if style:
-                if element.getparent() is None:
-                    style.display = 'block'
-                else:
-                    style.display = 'none'
+                # Styles returned by style_for() are shared, change a copy.
+                style = style.updated_copy({'display': (
+                    'block' if element.getparent() is None else 'none')})
             return style
         box, = element_to_box(element_tree, root_style_for, get_image_from_uri)
     box.is_for_root_element = True
@@ -73,18 +72,20 @@ def build_formatting_structure(element_tree, style_for, get_image_from_uri):
 
 
 def make_box(element_tag, sourceline, style, content, get_image_from_uri):
+    box = BOX_TYPE_FROM_DISPLAY[style.display](
+        element_tag, sourceline, style, content)
+    # ``style`` may be shared with other elements, only change the copy
+    # of the box.
     if (style.display in ('table', 'inline-table')
             and style.border_collapse == 'collapse'):
         # Padding do not apply
         for side in ['top', 'bottom', 'left', 'right']:
-            style['padding_' + side] = ZERO_PIXELS
+            box.style['padding_' + side] = ZERO_PIXELS
     if style.display.startswith('table-') and style.display != 'table-caption':
         # Margins do not apply
         for side in ['top', 'bottom', 'left', 'right']:
-            style['margin_' + side] = ZERO_PIXELS
-
-    return BOX_TYPE_FROM_DISPLAY[style.display](element_tag, sourceline,
-                                                style, content)
+            box.style['margin_' + side] = ZERO_PIXELS
+    return box
 
 
 def element_to_box(element, style_for, get_image_from_uri, state=None):
@@ -174,7 +175,7 @@ def element_to_box(element, style_for, get_image_from_uri, state=None):
             counter_values.pop(name)
 
     box = box.copy_with_children(children)
-    replace_content_lists(element, box, style, counter_values)
+    replace_content_lists(element, box, counter_values)
 
     # Specific handling for the element. (eg. replaced element)
     return html.handle_element(element, box, get_image_from_uri)
@@ -282,13 +283,15 @@ def compute_content_list_string(element, box, counter_values, content_list):
     return string
 
 
-def replace_content_lists(element, box, style, counter_values):
-    """Replace the content-lists by strings.
+def replace_content_lists(element, box, counter_values):
+    """Replace the content-lists by strings in the style of ``box``.
 
     These content-lists are used in GCPM properties like ``string-set`` and
-    ``bookmark-label``.
+    ``bookmark-label``. The style given by ``style_for`` is not modified: it
+    may be shared with other elements.
 
     """
+    style = box.style
     string_set = []
     if style.string_set != 'none':
         for i, (string_name, string_values) in enumerate(style.string_set):
@@ -18,25 +18,170 @@
 
 from __future__ import division, unicode_literals
 import os.path
+import sys
 import logging
+import hashlib
+import pickle
+import tempfile
 import re
 
 from .css import get_child_text
 from .formatting_structure import boxes
 from .urls import get_url_attribute
-from .compat import xrange, urljoin
+from .compat import xrange, urljoin, basestring
 from .logger import LOGGER
-from . import CSS
+from . import CSS, VERSION
 
 
-# XXX temporarily disable logging for user-agent stylesheet
-level = LOGGER.level
-LOGGER.setLevel(logging.ERROR)
+HTML5_UA_FILENAME = os.path.join(
+    os.path.dirname(__file__), 'css', 'html5_ua.css')
 
-HTML5_UA_STYLESHEET = CSS(
-    filename=os.path.join(os.path.dirname(__file__), 'css', 'html5_ua.css'))
+# Memoized result of get_ua_stylesheet()
+LOADED_UA_STYLESHEET = None
 
-LOGGER.setLevel(level)
+# Directory of the disk cache of the user-agent stylesheet, or None
+UA_STYLESHEET_CACHE_DIRECTORY = None
+
+
+def get_cache_directory():
+    """Return the directory where WeasyPrint caches data between runs.
+
+    This is :file:`weasyprint` in ``$XDG_CACHE_HOME``, defaulting to
+    :file:`~/.cache/weasyprint`.
+
+    """
+    return os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or
+        os.path.join(os.path.expanduser('~'), '.cache'),
+        'weasyprint')
+
+
+def get_ua_stylesheet_digest(filename):
+    """Return a digest of the user-agent stylesheet and of the code used to
+    preprocess it.
+
+    Any change to the stylesheet, to the CSS modules, to WeasyPrint's version
+    or to Python's version gives a different digest.
+
+    """
+    css_directory = os.path.join(os.path.dirname(__file__), 'css')
+    digest = hashlib.sha1()
+    digest.update(VERSION.encode('ascii'))
+    digest.update(sys.version.encode('utf8'))
+    for name in [filename] + sorted(
+            os.path.join(css_directory, name)
+            for name in os.listdir(css_directory) if name.endswith('.py')):
+        with open(name, 'rb') as fd:
+            digest.update(fd.read())
+    return digest.hexdigest()
+
+
+def set_ua_stylesheet_cache_directory(directory):
+    """Enable or disable the disk cache of the user-agent stylesheet.
+
+    When enabled, the HTML5 user-agent stylesheet is parsed and preprocessed
+    once, and then unpickled from ``directory`` by the following processes.
+    This makes the first render of each process faster. The cache is
+    disabled by default.
+
+    :param directory:
+        The directory where the stylesheet is cached, for example
+        :func:`get_cache_directory`, or :obj:`None` to disable the cache.
+        The directory is created if needed. Only use directories that are
+        not writable by untrusted users: pickles are not safe to load from
+        untrusted sources.
+
+    """
+    global UA_STYLESHEET_CACHE_DIRECTORY, LOADED_UA_STYLESHEET
+    UA_STYLESHEET_CACHE_DIRECTORY = directory
+    LOADED_UA_STYLESHEET = None
+
+
+def load_ua_stylesheet(filename=HTML5_UA_FILENAME, cache_directory=None):
+    """Parse and preprocess a user-agent stylesheet, using a disk cache.
+
+    If ``cache_directory`` is not :obj:`None`, the preprocessed :class:`CSS`
+    object is pickled there under a name depending on
+    :func:`get_ua_stylesheet_digest`, so that stale caches are never used.
+    Any error while reading or writing the cache is ignored and the
+    stylesheet is then parsed normally.
+
+    """
+    if cache_directory is None:
+        return parse_ua_stylesheet(filename)
+    try:
+        cache_filename = os.path.join(cache_directory, '%s-%s.pickle' % (
+            os.path.splitext(os.path.basename(filename))[0],
+            get_ua_stylesheet_digest(filename)))
+        with open(cache_filename, 'rb') as fd:
+            return pickle.load(fd)
+    except Exception:
+        pass
+
+    stylesheet = parse_ua_stylesheet(filename)
+    try:
+        if not os.path.isdir(cache_directory):
+            os.makedirs(cache_directory)
+        # Write in a temporary file first so that concurrent processes never
+        # read a partial cache.
+        fd, temp_filename = tempfile.mkstemp(dir=cache_directory)
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                pickle.dump(stylesheet, temp_file, pickle.HIGHEST_PROTOCOL)
+            os.rename(temp_filename, cache_filename)
+        except Exception:
+            os.remove(temp_filename)
+            raise
+    except Exception:
+        pass
+    return stylesheet
+
+
+def parse_ua_stylesheet(filename):
+    """Parse and preprocess a user-agent stylesheet."""
+    # XXX temporarily disable logging for user-agent stylesheet
+    level = LOGGER.level
+    LOGGER.setLevel(logging.ERROR)
+    try:
+        return CSS(filename=filename)
+    finally:
+        LOGGER.setLevel(level)
+
+
+def get_ua_stylesheet():
+    """Return the HTML5 user-agent stylesheet, loaded on first use.
+
+    It is cached on disk if :func:`set_ua_stylesheet_cache_directory` was
+    called.
+
+    """
+    global LOADED_UA_STYLESHEET
+    if LOADED_UA_STYLESHEET is None:
+        LOADED_UA_STYLESHEET = load_ua_stylesheet(
+            cache_directory=UA_STYLESHEET_CACHE_DIRECTORY)
+    return LOADED_UA_STYLESHEET
+
+
+class LazyUAStylesheet(CSS):
+    """A :class:`CSS` object for the HTML5 user-agent stylesheet, only
+    loaded when one of its attributes is used.
+
+    The stylesheet is the one given by :func:`get_ua_stylesheet`.
+
+    """
+    def __init__(self):
+        # The attributes of CSS objects are given by __getattr__.
+        pass
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            # Don't load the stylesheet for special methods.
+            raise AttributeError(name)
+        return getattr(get_ua_stylesheet(), name)
+
+
+# Kept for compatibility, use get_ua_stylesheet() instead.
+HTML5_UA_STYLESHEET = LazyUAStylesheet()
 
 
 # http://whatwg.org/C#space-character
@@ -250,6 +395,42 @@ def handle_a(element, box, _get_image_from_uri):
     return [box]
 
 
+def find_resource_urls(element_tree, style_for):
+    """Yield the URLs of the images needed to render ``element_tree``.
+
+    These are the sources of ``<img>``, ``<embed>`` and ``<object>``
+    elements, and the URLs in ``background-image`` and ``list-style-image``,
+    in tree order. Elements with ``display: none`` are ignored, and so is
+    the fallback content of ``<object>`` elements.
+
+    """
+    elements = [element_tree]
+    while elements:
+        element = elements.pop()
+        if not isinstance(element.tag, basestring):
+            continue
+        style = style_for(element)
+        if style.display == 'none':
+            continue
+        url = None
+        if element.tag in ('img', 'embed'):
+            url = get_url_attribute(element, 'src')
+        elif element.tag == 'object':
+            url = get_url_attribute(element, 'data')
+        if url:
+            yield url
+        if style.visibility != 'hidden':
+            for type_, value in style.background_image:
+                if type_ == 'url':
+                    yield value
+        if style.display == 'list-item':
+            type_, value = style.list_style_image
+            if type_ == 'url':
+                yield value
+        if not (element.tag == 'object' and url):
+            elements.extend(reversed(element))
+
+
 def find_base_url(html_document, fallback_base_url):
     """Return the base URL for the document.
 
@@ -14,6 +14,8 @@ from __future__ import division, unicode_literals
 
 from io import BytesIO
 import math
+import struct
+import threading
 
 import cairocffi
 cairocffi.install_as_pycairo()  # for CairoSVG
@@ -30,7 +32,7 @@ try:
 except OSError:
     pixbuf = None
 
-from .urls import fetch, URLFetchingError
+from .urls import fetch, open_file_url, MappedFile, URLFetchingError
 from .logger import LOGGER
 from .compat import xrange
 
@@ -60,9 +62,23 @@ class ImageLoadingError(ValueError):
 
 class RasterImage(object):
     def __init__(self, image_surface):
-        self.image_surface = image_surface
-        self._intrinsic_width = image_surface.get_width()
-        self._intrinsic_height = image_surface.get_height()
+        self._image_surface = image_surface
+        self._set_intrinsic_size(
+            image_surface.get_width(), image_surface.get_height())
+
+    @property
+    def image_surface(self):
+        return self._image_surface
+
+    @property
+    def surface_size(self):
+        """The approximate memory size of the decoded image, in bytes."""
+        surface = self._image_surface
+        return surface.get_stride() * surface.get_height()
+
+    def _set_intrinsic_size(self, width, height):
+        self._intrinsic_width = width
+        self._intrinsic_height = height
         self.intrinsic_ratio = (
             self._intrinsic_width / self._intrinsic_height
             if self._intrinsic_height != 0 else float('inf'))
@@ -75,16 +91,170 @@ class RasterImage(object):
     def draw(self, context, concrete_width, concrete_height, image_rendering):
         if concrete_width > 0 and concrete_height > 0 and \
                 self._intrinsic_width > 0 and self._intrinsic_height > 0:
-            # Use the real intrinsic size here,
+            image_surface = self.image_surface
+            # Use the real size of the surface here,
             # not affected by 'image-resolution'.
-            context.scale(concrete_width / self._intrinsic_width,
-                          concrete_height / self._intrinsic_height)
-            context.set_source_surface(self.image_surface)
+            context.scale(concrete_width / image_surface.get_width(),
+                          concrete_height / image_surface.get_height())
+            context.set_source_surface(image_surface)
             context.get_source().set_filter(
                 IMAGE_RENDERING_TO_FILTER[image_rendering])
             context.paint()
 
 
+class LazyRasterImage(RasterImage):
+    """A raster image only decoded when drawn.
+
+    The intrinsic size is read from the header of the image: the layout does
+    not need the pixels, and images of pages that are never drawn are never
+    decoded.
+
+    ``string`` is the encoded image, or :obj:`None` to map the local file at
+    ``file_url`` again when the image is decoded: keeping the mapped file
+    would keep a file descriptor open for each image.
+
+    Images are shared by the renders using a :class:`cache.ResourceCache`,
+    they are decoded under a lock. The encoded image is forgotten once
+    decoded, and errors are kept to be reported at each draw.
+
+    """
+    def __init__(self, string, mime_type, url, width, height, file_url=None):
+        self._string = string
+        self._file_url = file_url
+        self._mime_type = mime_type
+        self._url = url
+        self._image_surface = None
+        self._error = None
+        self._lock = threading.Lock()
+        self._set_intrinsic_size(width, height)
+
+    @property
+    def image_surface(self):
+        with self._lock:
+            if self._image_surface is None:
+                if self._error is None:
+                    try:
+                        self._image_surface = self._decode()
+                    except ImageLoadingError as exc:
+                        self._error = exc
+                        raise
+                    self._string = self._file_url = None
+                else:
+                    raise ImageLoadingError(str(self._error))
+            return self._image_surface
+
+    def _decode(self):
+        if self._string is not None:
+            return decode_raster_image(self._string, self._mime_type)
+        try:
+            # The file may have been removed or changed since the layout.
+            result = open_file_url(self._file_url)
+        except (IOError, OSError, ValueError) as exc:
+            raise ImageLoadingError.from_exception(exc)
+        if result is None:
+            raise ImageLoadingError('Not a local file: %s' % self._file_url)
+        file_obj = result['file_obj']
+        try:
+            return decode_raster_image(file_obj, self._mime_type)
+        finally:
+            file_obj.close()
+
+    @property
+    def surface_size(self):
+        """The memory size of the image, counted before it is decoded."""
+        if self._image_surface is not None:
+            return super(LazyRasterImage, self).surface_size
+        # Decoded images use 4 bytes per pixel, in ARGB32 or RGB24 format.
+        return self._intrinsic_width * self._intrinsic_height * 4
+
+    def draw(self, context, concrete_width, concrete_height, image_rendering):
+        try:
+            self.image_surface
+        except ImageLoadingError as exc:
+            LOGGER.warning('Failed to load image at %s : %s', self._url, exc)
+            return
+        super(LazyRasterImage, self).draw(
+            context, concrete_width, concrete_height, image_rendering)
+
+
+def get_raster_size(string):
+    """Read the size of a PNG, JPEG or GIF image from its header.
+
+    ``string`` is a byte string or a mapped file, only its first bytes are
+    read. Return a ``(format_name, width, height)`` tuple, or :obj:`None`
+    for other formats and for invalid or empty images.
+
+    """
+    if string[:8] == b'\x89PNG\r\n\x1a\n' and string[12:16] == b'IHDR' and \
+            len(string) >= 24:
+        format_name = 'png'
+        width, height = struct.unpack('>II', string[16:24])
+    elif string[:6] in (b'GIF87a', b'GIF89a') and len(string) >= 10:
+        format_name = 'gif'
+        width, height = struct.unpack('<HH', string[6:10])
+    elif string[:2] == b'\xff\xd8':
+        format_name = 'jpeg'
+        position = 2
+        while True:
+            if position + 4 > len(string):
+                return None
+            marker_start, marker = struct.unpack_from('>BB', string, position)
+            if marker_start != 0xff:
+                return None
+            elif marker == 0xff:
+                # Fill byte
+                position += 1
+            elif marker == 0x01 or 0xd0 <= marker <= 0xd8:
+                # Marker without a segment
+                position += 2
+            elif marker == 0xda:
+                # Start of scan, the size should have been given before
+                return None
+            elif 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+                # Start of frame: length, precision, height, width
+                if position + 9 > len(string):
+                    return None
+                height, width = struct.unpack_from('>HH', string, position + 5)
+                break
+            else:
+                length, = struct.unpack_from('>H', string, position + 2)
+                position += 2 + length
+    else:
+        return None
+    if width == 0 or height == 0:
+        return None
+    return format_name, width, height
+
+
+def decode_raster_image(data, mime_type):
+    """Decode a raster image into a cairo ImageSurface.
+
+    ``data`` is a byte string, or a file object at its start like a
+    :class:`urls.MappedFile`. PNG images are decoded by cairo, reading file
+    objects directly.
+    Other formats need GDK-Pixbuf.
+
+    """
+    if mime_type == 'image/png':
+        file_obj = BytesIO(data) if isinstance(data, bytes) else data
+        try:
+            return cairocffi.ImageSurface.create_from_png(file_obj)
+        except Exception as exc:
+            raise ImageLoadingError.from_exception(exc)
+    if pixbuf is None:
+        raise ImageLoadingError(
+            'Could not load GDK-Pixbuf. '
+            'PNG and SVG are the only image formats available.')
+    string = data if isinstance(data, bytes) else data.read()
+    try:
+        surface, format_name = pixbuf.decode_to_image_surface(string)
+    except pixbuf.ImageLoadingError as exc:
+        raise ImageLoadingError(str(exc))
+    if format_name == 'jpeg' and CAIRO_HAS_MIME_DATA:
+        surface.set_mime_data('image/jpeg', string)
+    return surface
+
+
 class ScaledSVGSurface(cairosvg.surface.SVGSurface):
     """
     Have the cairo Surface object have intrinsic dimension
@@ -151,32 +321,35 @@ def get_image_from_uri(cache, url_fetcher, url, forced_mime_type=None):
     try:
         with fetch(url_fetcher, url) as result:
             mime_type = forced_mime_type or result['mime_type']
+            file_obj = result.get('file_obj')
             if mime_type == 'image/svg+xml':
                 string = (result['string'] if 'string' in result
-                          else result['file_obj'].read())
+                          else file_obj.read())
                 image = SVGImage(string, url)
-            elif mime_type == 'image/png':
-                obj = result.get('file_obj') or BytesIO(result.get('string'))
-                try:
-                    surface = cairocffi.ImageSurface.create_from_png(obj)
-                except Exception as exc:
-                    raise ImageLoadingError.from_exception(exc)
-                image = RasterImage(surface)
             else:
-                if pixbuf is None:
-                    raise ImageLoadingError(
-                        'Could not load GDK-Pixbuf. '
-                        'PNG and SVG are the only image formats available.')
-                string = (result['string'] if 'string' in result
-                          else result['file_obj'].read())
-                try:
-                    surface, format_name = (
-                        pixbuf.decode_to_image_surface(string))
-                except pixbuf.ImageLoadingError as exc:
-                    raise ImageLoadingError(str(exc))
-                if format_name == 'jpeg' and CAIRO_HAS_MIME_DATA:
-                    surface.set_mime_data('image/jpeg', string)
-                image = RasterImage(surface)
+                # Read mapped local files in place, without copying them.
+                mapped = isinstance(file_obj, MappedFile)
+                data = (
+                    file_obj if mapped
+                    else result['string'] if 'string' in result
+                    else file_obj.read())
+                header = get_raster_size(
+                    file_obj.mapping if mapped else data)
+                # Only decode lazily the images that the decoder supports,
+                # other images fail to load now.
+                if header is not None and (
+                        header[0] == 'png' if mime_type == 'image/png'
+                        else pixbuf is not None):
+                    _format_name, width, height = header
+                    if mapped:
+                        image = LazyRasterImage(
+                            None, mime_type, url, width, height,
+                            file_url=result['redirected_url'])
+                    else:
+                        image = LazyRasterImage(
+                            data, mime_type, url, width, height)
+                else:
+                    image = RasterImage(decode_raster_image(data, mime_type))
     except (URLFetchingError, ImageLoadingError) as exc:
         LOGGER.warning('Failed to load image at %s : %s', url, exc)
         image = None
@@ -21,6 +21,7 @@
 from __future__ import division, unicode_literals
 from collections import defaultdict
 from ..compat import xrange
+from ..lru import LRUCache
 
 from .absolute import absolute_box_layout
 from .pages import make_all_pages, make_margin_boxes
@@ -75,6 +76,13 @@ class LayoutContext(object):
         self.excluded_shapes = None  # Not initialized yet
         self.string_set = defaultdict(lambda: defaultdict(lambda: list()))
         self.current_page = None
+        # Keys are TextBox objects, values are ``(skip, paragraph)`` tuples
+        # where ``paragraph`` is a text.ParagraphLayout of ``box.text[skip:]``
+        # or None if paragraph layouts do not help for this box. Cleared for
+        # each page.
+        self.paragraph_layouts = {}
+        # Results of text.line_widths(), for preferred widths
+        self.line_widths_cache = LRUCache(maxsize=4096)
 
     def create_block_formatting_context(self):
         self.excluded_shapes = []
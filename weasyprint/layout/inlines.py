@@ -20,7 +20,7 @@ from .percentages import resolve_percentages, resolve_one_percentage
 from .preferred import (shrink_to_fit, inline_preferred_minimum_width,
                         trailing_whitespace_size)
 from .tables import find_in_flow_baseline, table_wrapper_width
-from ..text import split_first_line
+from ..text import split_first_line, ParagraphLayout
 from ..formatting_structure import boxes
 from ..css.computed_values import strut_layout, ex_ratio
 
@@ -676,22 +676,29 @@ def split_text_box(context, box, available_width, line_width, skip):
 
     """
     assert isinstance(box, boxes.TextBox)
+    original_box = box
     font_size = box.style.font_size
     text = box.text[skip:]
     if font_size == 0 or not text:
         return None, None, False
+    paragraph, paragraph_index = get_paragraph_layout(
+        context, box, available_width, skip)
+    # The UTF-8 text of the box is encoded only once, for all its lines.
+    text_run = box.text_run()
+    start = text_run.utf8_index(skip)
     # XXX ``resume_at`` is an index in UTF-8 bytes, not unicode codepoints.
     layout, length, resume_at, width, height, baseline = split_first_line(
-        text, box.style, context.enable_hinting, available_width, line_width)
+        text, box.style, context.enable_hinting, available_width, line_width,
+        paragraph, paragraph_index, text_run, start)
 
     # Convert ``length`` and ``resume_at`` from UTF-8 indexes in text
     # to Unicode indexes.
-    # No need to encode what’s after resume_at (if set) or length (if
-    # resume_at is not set). One code point is one or more byte, so
-    # UTF-8 indexes are always bigger or equal to Unicode indexes.
-    partial_text = text[:resume_at or length]
-    utf8_text = partial_text.encode('utf8')
-    new_text = utf8_text[:length].decode('utf8')
+    if resume_at is not None and length > resume_at:
+        # Text has been hyphenated, ``resume_at`` is a Unicode index.
+        stop = text_run.utf8_index(skip + resume_at)
+    else:
+        stop = len(text_run.utf8)
+    new_text = text_run.slice(start, min(start + length, stop))
     new_length = len(new_text)
     if resume_at is not None:
         if length > resume_at:
@@ -699,11 +706,12 @@ def split_text_box(context, box, available_width, line_width, skip):
             new_text += box.style.hyphenate_character
             between = ''
         else:
-            between = utf8_text[length:resume_at].decode('utf8')
+            between = text_run.slice(start + length, start + resume_at)
             if width > available_width:
                 if between.strip(' ') not in ('', '\n', '\u2029'):
                     # Replace bad cutting value from Pango
-                    between = utf8_text[length:new_length].decode('utf8')
+                    between = text_run.slice(
+                        start + length, start + new_length)
             resume_at = new_length + len(between)
     length = new_length
 
@@ -744,9 +752,51 @@ def split_text_box(context, box, available_width, line_width, skip):
                 'Expected nothing or a preserved line break' % (between,))
         resume_at += skip
 
+    if resume_at is None:
+        context.paragraph_layouts.pop(original_box, None)
+
     return box, resume_at, preserved_line_break
 
 
+def get_paragraph_layout(context, box, available_width, skip):
+    """Return ``(paragraph, paragraph_index)`` for split_first_line().
+
+    Only lines after the first one of a text box use paragraph layouts: the
+    text is then known to need multiple lines. The layout is kept in
+    ``context`` for the following lines, and laid out again from the current
+    line when hyphenation or ``overflow-wrap`` moved a line break, as long
+    as it was used for more than one line.
+
+    Layouts are forgotten when the last line of the box is found, and at
+    each page for the boxes whose lines are abandoned or laid out again.
+
+    """
+    if not skip or available_width is None:
+        return None, 0
+    paragraph_skip, paragraph = context.paragraph_layouts.get(
+        box, (None, None))
+    if paragraph_skip is not None:
+        if paragraph is None:
+            # Paragraph layouts did not help for this box.
+            return None, 0
+        text_run = box.text_run()
+        paragraph_index = (
+            text_run.utf8_index(skip) - text_run.utf8_index(paragraph_skip))
+        if (skip >= paragraph_skip and
+                paragraph.max_width == available_width and
+                paragraph_index in paragraph.line_starts):
+            return paragraph, paragraph_index
+        if paragraph.lines_used < 2:
+            context.paragraph_layouts[box] = skip, None
+            return None, 0
+    text_run = box.text_run()
+    paragraph = ParagraphLayout(
+        box.text[skip:], box.style, context.enable_hinting, available_width,
+        text_run, text_run.utf8_index(skip))
+    context.paragraph_layouts[box] = skip, paragraph
+    return paragraph, 0
+
+
 def line_box_verticality(box):
     """Handle ``vertical-align`` within an :class:`LineBox` (or of a
     non-align sub-tree).
@@ -468,10 +468,15 @@ def make_page(context, root_box, page_type, resume_at, content_empty,
                       or ``None`` for the first page.
 
     """
-    style = context.style_for(page_type)
-    # Propagated from the root or <body>.
-    style.overflow = root_box.viewport_overflow
-    page = boxes.PageBox(page_type, style)
+    # Forget the paragraph layouts of the previous pages: their remaining
+    # lines are laid out again from where the text boxes are cut, and boxes
+    # that were abandoned or discarded never use theirs.
+    context.paragraph_layouts.clear()
+
+    page = boxes.PageBox(page_type, context.style_for(page_type))
+    # Propagated from the root or <body>. The style given by ``style_for``
+    # is shared by the pages of the same type, change the copy of the page.
+    page.style.overflow = root_box.viewport_overflow
 
     device_size = page.style.size
 
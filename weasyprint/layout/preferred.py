@@ -237,7 +237,8 @@ def inline_line_widths(context, box, outer, is_line_start, minimum,
             else:
                 lines = list(text.line_widths(
                     child_text, child.style, context.enable_hinting,
-                    width=0 if minimum else None))
+                    width=0 if minimum else None,
+                    cache=context.line_widths_cache))
         else:
             # http://www.w3.org/TR/css3-text/#line-break-details
             # "The line breaking behavior of a replaced element
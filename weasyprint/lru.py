@@ -0,0 +1,106 @@
+# coding: utf8
+"""
+    weasyprint.lru
+    --------------
+
+    A bounded mapping dropping the least recently used items, for the
+    various caches that live longer than a single document.
+
+    :copyright: Copyright 2011-2014 Simon Sapin and contributors, see AUTHORS.
+    :license: BSD, see LICENSE for details.
+
+"""
+
+from __future__ import division, unicode_literals
+
+import threading
+
+from .compat import OrderedDict
+
+
+class LRUCache(object):
+    """A dict-like cache keeping at most ``maxsize`` items.
+
+    When full, the least recently used item is dropped. The ``hits`` and
+    ``misses`` attributes count the lookups made with :meth:`get`.
+
+    If ``getsize`` is given, it is called with each value and ``maxsize`` is
+    the maximum total size of the values instead of their number, kept in
+    the ``currsize`` attribute. Values bigger than ``maxsize`` are not kept.
+
+    Caches are shared by documents rendered in different threads: all the
+    methods hold a lock while changing the items and their sizes.
+
+    """
+    def __init__(self, maxsize=128, getsize=None):
+        self.maxsize = maxsize
+        self.getsize = getsize
+        self.currsize = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the value for ``key`` and mark it as recently used."""
+        data = self._data
+        with self._lock:
+            try:
+                value = data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            data[key] = value
+            self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        data = self._data
+        # Call getsize() outside of the lock, it may be slow.
+        size = None if self.getsize is None else self.getsize(value)
+        with self._lock:
+            self._pop(key, None)
+            if size is None:
+                data[key] = value
+                while len(data) > self.maxsize:
+                    data.popitem(last=False)
+            elif size <= self.maxsize:
+                data[key] = value
+                self._sizes[key] = size
+                self.currsize += size
+                while self.currsize > self.maxsize:
+                    old_key, _old_value = data.popitem(last=False)
+                    self.currsize -= self._sizes.pop(old_key)
+
+    def pop(self, key, default=None):
+        """Remove ``key`` and return its value, or ``default``."""
+        with self._lock:
+            return self._pop(key, default)
+
+    def _pop(self, key, default):
+        size = self._sizes.pop(key, None)
+        if size is not None:
+            self.currsize -= size
+        return self._data.pop(key, default)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        """Remove all items and reset the statistics."""
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.currsize = 0
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """Return a dict of statistics about the cache."""
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses,
+                        size=len(self._data), maxsize=self.maxsize)
@@ -28,13 +28,19 @@ import pytest
 
 from .testing_utils import (
     resource_filename, assert_no_logs, capture_logs, TestHTML,
-    http_server, temp_directory)
+    http_server, keep_alive_http_server, temp_directory)
 from .test_draw import image_to_pixels
 from ..compat import urljoin, urlencode, urlparse_uses_relative, iteritems
-from ..urls import path2url
+from ..urls import (
+    path2url, open_data_url, PrefetchingURLFetcher, ConnectionPool,
+    set_connection_pool_size, uses_proxy, DATA_URL_CACHE)
+from ..compat import HTTPError
+from ..cache import ResourceCache
+from ..lru import LRUCache
 from .. import HTML, CSS, default_url_fetcher
 from .. import __main__
 from .. import navigator
+from ..text import preload_fonts
 from ..document import _TaggedTuple
 
 
@@ -400,6 +406,19 @@ def test_command_line_render():
             stdout = run('--format png --base-url .. - -', stdin=combined)
             assert stdout == png_bytes
 
+            stdout = run('--format png --preload-fonts serif,monospace '
+                         '--base-url .. - -', stdin=combined)
+            assert stdout == png_bytes
+
+            preloaded = []
+            __main__.preload_fonts = preloaded.append
+            try:
+                run('--format png --preload-fonts serif,,monospace, '
+                    '--base-url .. - -', stdin=combined)
+            finally:
+                __main__.preload_fonts = preload_fonts
+            assert preloaded == [['serif', 'monospace']]
+
 
 @assert_no_logs
 def test_unicode_filenames():
@@ -925,6 +944,163 @@ def test_url_fetcher():
                     'é_%e9.css"><body>', url_fetcher=fetcher_2).render()
 
 
+@assert_no_logs
+def test_url_fetcher_results():
+    """Test the cache of data URLs and the mapping of file URLs."""
+    DATA_URL_CACHE.clear()
+    url = 'data:text/plain;base64,Zm9vbw=='
+    result = open_data_url(url)
+    result['string'] = b'changed'
+    assert len(DATA_URL_CACHE) == 1
+    assert open_data_url(url)['string'] == b'fooo'
+    assert DATA_URL_CACHE.info()['hits'] == 1
+
+    url = path2url(resource_filename('pattern.png'))
+    result = default_url_fetcher(url)
+    assert result['mime_type'] == 'image/png'
+    assert result['redirected_url'] == url
+    try:
+        with open(resource_filename('pattern.png'), 'rb') as fd:
+            content = fd.read()
+        assert result['file_obj'].read(4) == content[:4]
+        assert result['file_obj'].read() == content[4:]
+        assert result['file_obj'].read() == b''
+    finally:
+        result['file_obj'].close()
+
+
+@assert_no_logs
+def test_prefetch():
+    """Test fetching resources in advance with worker threads."""
+    pattern_png = read_file(resource_filename('pattern.png'))
+    fetched = []
+
+    def fetcher(url):
+        fetched.append((url, threading.current_thread().name))
+        if url.endswith('.css'):
+            return dict(string='body { background: url(bg.png) }',
+                        mime_type='text/css')
+        elif url.endswith('.png'):
+            return dict(string=pattern_png, mime_type='image/png')
+        raise ValueError('Unknown URL')
+
+    prefetcher = PrefetchingURLFetcher(fetcher, 2)
+    prefetcher.prefetch([
+        'weasyprint-custom:a.png', 'weasyprint-custom:b', 'data:,'])
+    assert prefetcher('weasyprint-custom:a.png')['string'] == pattern_png
+    with pytest.raises(ValueError):
+        prefetcher('weasyprint-custom:b')
+    # Results are only given once.
+    assert prefetcher('weasyprint-custom:a.png')['string'] == pattern_png
+    assert sorted(url for url, _thread in fetched[:2]) == [
+        'weasyprint-custom:a.png', 'weasyprint-custom:b']
+    assert fetched[2] == (
+        'weasyprint-custom:a.png', threading.current_thread().name)
+
+    css = CSS(string='''
+        @page { size: 8px; margin: 2px; background: #fff }
+        body { margin: 0; font-size: 0 }
+    ''')
+    del fetched[:]
+    html = TestHTML(string='''
+        <link rel=stylesheet href="weasyprint-custom:style.css">
+        <style>@import url(weasyprint-custom:imported.css);</style>
+        <img src="weasyprint-custom:img.png">
+        <img src="weasyprint-custom:hidden.png" style="display: none">
+        <object data="weasyprint-custom:object.png">
+          <img src="weasyprint-custom:fallback.png">
+        </object>
+    ''', url_fetcher=fetcher, prefetch_concurrency=4)
+    html.write_png(stylesheets=[css])
+    # Each resource is fetched once, hidden and fallback images are not.
+    assert sorted(url for url, _thread in fetched) == [
+        'weasyprint-custom:bg.png', 'weasyprint-custom:img.png',
+        'weasyprint-custom:imported.css', 'weasyprint-custom:object.png',
+        'weasyprint-custom:style.css']
+    # Imported stylesheets are prefetched too.
+    assert dict(fetched)['weasyprint-custom:imported.css'] != (
+        threading.current_thread().name)
+
+
+@assert_no_logs
+def test_resource_cache():
+    """Test the cache of resources shared by renders."""
+    pattern_png = read_file(resource_filename('pattern.png'))
+    requests = []
+
+    def logo(environ):
+        requests.append(('/logo.png', environ.get('HTTP_IF_NONE_MATCH')))
+        headers = [('ETag', '"v1"'), ('Cache-Control', 'no-cache'),
+                   ('Content-Type', 'image/png')]
+        if environ.get('HTTP_IF_NONE_MATCH') == '"v1"':
+            return '304 Not Modified', b'', headers
+        return pattern_png, headers
+
+    def counted(path, response, headers):
+        def handler(environ):
+            requests.append((path, environ.get('HTTP_IF_NONE_MATCH')))
+            return response, headers
+        return handler
+
+    with http_server({
+        '/logo.png': logo,
+        '/style.css': counted('/style.css', b'body { margin: 0 }', [
+            ('Content-Type', 'text/css'), ('Cache-Control', 'max-age=60')]),
+        '/page.html': counted('/page.html', b'<p>a', [
+            ('Content-Type', 'text/html'), ('Cache-Control', 'no-store')]),
+    }) as root_url:
+        with temp_directory() as directory:
+            cache = ResourceCache(directory=directory)
+            for _i in range(2):
+                assert cache(root_url + '/style.css')['string'] == (
+                    b'body { margin: 0 }')
+                assert cache(root_url + '/page.html')['string'] == b'<p>a'
+            # Fresh resources are not requested again, resources that can
+            # not be stored are.
+            assert requests == [
+                ('/style.css', None), ('/page.html', None),
+                ('/page.html', None)]
+            assert len(os.listdir(directory)) == 1
+
+            # The disk store is shared with other caches.
+            del requests[:]
+            other_cache = ResourceCache(directory=directory)
+            assert other_cache(root_url + '/style.css')['string'] == (
+                b'body { margin: 0 }')
+            assert requests == []
+
+            # Decoded images are kept as long as they are validated.
+            css = CSS(string='''
+                @page { size: 8px; margin: 2px; background: #fff }
+                body { margin: 0; font-size: 0 }
+            ''')
+            html = '<body><img src="%s/logo.png">' % root_url
+            check_png_pattern(TestHTML(string=html, url_fetcher=cache)
+                              .write_png(stylesheets=[css]))
+            resource = cache.get(root_url + '/logo.png')
+            image = resource.image
+            assert image is not None
+            # Decoded pixels are counted in the size of the cache.
+            assert resource.get_size() == (
+                len(resource.result['string']) + 4 * 4 * 4)
+            check_png_pattern(TestHTML(string=html, url_fetcher=cache)
+                              .write_png(stylesheets=[css]))
+            assert cache.get(root_url + '/logo.png').image is image
+            assert requests == [('/logo.png', None), ('/logo.png', '"v1"')]
+
+    # The memory cache is limited by size.
+    cache = LRUCache(maxsize=10, getsize=len)
+    cache['a'] = 'abcd'
+    cache['b'] = 'efgh'
+    cache['c'] = 'ijkl'
+    cache['d'] = 'mnopqrstuvwxyz'
+    assert 'a' not in cache
+    assert 'd' not in cache
+    assert cache.currsize == 8
+    assert cache.pop('b') == 'efgh'
+    assert cache.currsize == 4
+
+
 @assert_no_logs
 def test_html_meta():
     def assert_meta(html, **meta):
@@ -1009,3 +1185,94 @@ def test_http():
         assert HTML(root_url + '/gzip').root_element.get('test') == 'ok'
         assert HTML(root_url + '/deflate').root_element.get('test') == 'ok'
         assert HTML(root_url + '/raw-deflate').root_element.get('test') == 'ok'
+
+
+@assert_no_logs
+def test_connection_pool():
+    """Test the reuse of HTTP connections."""
+    def gzip_compress(data):
+        file_obj = io.BytesIO()
+        gzip_file = gzip.GzipFile(fileobj=file_obj, mode='wb')
+        gzip_file.write(data)
+        gzip_file.close()
+        return file_obj.getvalue()
+
+    with keep_alive_http_server({
+        '/gzip': lambda env: (
+            gzip_compress(b'<html test=ok>'),
+            [('Content-Type', 'text/html'), ('Content-Encoding', 'gzip')]),
+        '/deflate': lambda env: (
+            zlib.compress(b'<html test=ok>'),
+            [('Content-Type', 'text/html'), ('Content-Encoding', 'deflate')]),
+        '/style.css': lambda env: (
+            b'p { color: red }', [('Content-Type', 'text/css')]),
+        '/file': lambda env: (b'data', [
+            ('Content-Type', 'text/plain'),
+            ('Content-Disposition', 'attachment; filename="a.txt"')]),
+        '/redirect': lambda env: (
+            '302 Found', b'', [('Location', '/style.css')]),
+    }) as (root_url, connections):
+        pool = ConnectionPool()
+        try:
+            result = pool(root_url + '/gzip')
+            assert result['file_obj'].read() == b'<html test=ok>'
+            result['file_obj'].close()
+            assert pool(root_url + '/deflate')['string'] == (
+                b'<html test=ok>')
+            result = pool(root_url + '/redirect')
+            assert result['redirected_url'] == root_url + '/style.css'
+            assert result['mime_type'] == 'text/css'
+            assert result['file_obj'].read() == b'p { color: red }'
+            result['file_obj'].close()
+            result = pool(root_url + '/file')
+            if sys.version_info[0] >= 3:
+                assert result['filename'] == 'a.txt'
+            assert result['file_obj'].read() == b'data'
+            result['file_obj'].close()
+            with pytest.raises(HTTPError) as exc_info:
+                pool(root_url + '/missing')
+            assert exc_info.value.code == 404
+            assert len(connections) == 1
+        finally:
+            pool.close()
+
+        # Use the pool for the default url_fetcher.
+        del connections[:]
+        set_connection_pool_size(2)
+        try:
+            html = HTML(root_url + '/gzip')
+            assert html.root_element.get('test') == 'ok'
+            CSS(root_url + '/style.css')
+            assert default_url_fetcher(root_url + '/deflate')['string'] == (
+                b'<html test=ok>')
+            assert len(connections) == 1
+        finally:
+            set_connection_pool_size(0)
+
+
+@assert_no_logs
+def test_connection_pool_proxy():
+    """Test that URLs fetched through a proxy do not use the pool."""
+    with keep_alive_http_server({
+        'http://weasyprint.invalid/style.css': lambda env: (
+            b'p { color: red }', [('Content-Type', 'text/css')]),
+    }) as (proxy_url, connections):
+        old_environ = dict(
+            (name, os.environ.pop(name)) for name in list(os.environ)
+            if name.lower().endswith('_proxy'))
+        os.environ['http_proxy'] = proxy_url
+        os.environ['no_proxy'] = 'localhost,example.org'
+        pool = ConnectionPool()
+        try:
+            assert uses_proxy('http://weasyprint.invalid/')
+            assert not uses_proxy('http://example.org/')
+            assert not uses_proxy('http://user@localhost:8080/')
+            assert not uses_proxy('https://weasyprint.invalid/')
+            result = pool('http://weasyprint.invalid/style.css')
+            assert result['file_obj'].read() == b'p { color: red }'
+            result['file_obj'].close()
+            assert len(connections) == 1
+        finally:
+            pool.close()
+            del os.environ['http_proxy'], os.environ['no_proxy']
+            os.environ.update(old_environ)
@@ -653,6 +653,53 @@ def test_table_style():
     assert table.style.padding_top == (2, 'px')
 
 
+@assert_no_logs
+def test_collapsed_table_style():
+    """Test the styles changed for tables and their anonymous boxes."""
+    element, style_for, get_image_from_uri = _parse_base('''
+        <style>
+            table { border-collapse: collapse; margin: 1px; padding: 2px }
+            td { margin: 3px; padding: 4px }
+        </style>
+        <table><tr><td>A</td></tr></table>
+        <table><tr><td>B</td></tr></table>
+    ''')
+    html = build.build_formatting_structure(
+        element, style_for, get_image_from_uri)
+    body, = html.children
+    for wrapper, text in zip(body.children, 'AB'):
+        table, = wrapper.children
+        group, = table.children
+        row, = group.children
+        cell, = row.children
+        line, = cell.children
+        text_box, = line.children
+        assert text_box.text == text
+        assert wrapper.style.margin_top == (1, 'px')
+        assert wrapper.style.padding_top == (0, 'px')
+        assert table.style.margin_top == (0, 'px')
+        assert table.style.padding_top == (0, 'px')
+        assert table.style.border_top_width == 0
+        assert cell.style.margin_top == (0, 'px')
+        assert cell.style.padding_top == (4, 'px')
+        assert line.style.anonymous
+        assert line.style.padding_top == (0, 'px')
+
+    # Styles given by style_for() may be shared, they are not changed.
+    table_element = element.find('body').find('table')
+    assert style_for(table_element).padding_top == (2, 'px')
+    assert style_for(table_element.find('.//td')).margin_top == (3, 'px')
+
+    # The root element is displayed even with "display: none".
+    element, style_for, get_image_from_uri = _parse_base(
+        '<style>html { display: none }</style><p>a')
+    html = build.build_formatting_structure(
+        element, style_for, get_image_from_uri)
+    assert html.style.display == 'block'
+    assert html.children == []
+    assert style_for(element).display == 'none'
+
+
 @assert_no_logs
 def test_column_style():
     html = parse_all('''
@@ -1391,6 +1438,44 @@ def test_margin_box_string_set():
     assert bottom_text_box.text == 'before!last-secondclass2|1/I'
 
 
+@assert_no_logs
+def test_content_lists_shared_style():
+    """Test content-lists of siblings sharing their computed style."""
+    element, style_for, get_image_from_uri = _parse_base(
+        '<style>h1 { -weasy-string-set: title content() }</style>'
+        '<h1>First</h1><h1>Second</h1>')
+    h1_1, h1_2 = element.iter('h1')
+    assert style_for(h1_1) is style_for(h1_2)
+    html, = build.element_to_box(element, style_for, get_image_from_uri)
+    body, = html.children
+    box_1, box_2 = body.children
+    assert box_1.style.bookmark_label == 'First'
+    assert box_1.style.string_set == [('title', 'First')]
+    assert box_2.style.bookmark_label == 'Second'
+    assert box_2.style.string_set == [('title', 'Second')]
+    # The shared style keeps the content-lists.
+    assert style_for(h1_1).bookmark_label == [('content', 'text')]
+
+
+@assert_no_logs
+def test_content_lists_box_style():
+    """Test that content-lists are replaced in the style of built boxes."""
+    html = parse(
+        '<style>h1 { -weasy-string-set: title content() "!" }</style>'
+        '<div><h1>First</h1></div><section><h1>Second</h1></section>'
+        '<p>Text</p>')
+    body, = html.children
+    div, section, p = body.children
+    h1_1, = div.children
+    h1_2, = section.children
+    assert h1_1.style.bookmark_label == 'First'
+    assert h1_1.style.string_set == [('title', 'First!')]
+    assert h1_2.style.bookmark_label == 'Second'
+    assert h1_2.style.string_set == [('title', 'Second!')]
+    assert p.style.bookmark_label == 'Text'
+    assert p.style.string_set == []
+
+
 @assert_no_logs
 def test_page_counters():
     """Test page-based counters."""
@@ -12,14 +12,18 @@
 
 from __future__ import division, unicode_literals
 
+import os
+
 from pytest import raises
 
 from .testing_utils import (
-    resource_filename, assert_no_logs, capture_logs, TestHTML)
+    resource_filename, assert_no_logs, capture_logs, TestHTML, temp_directory)
 from .. import css
+from ..html import (
+    load_ua_stylesheet, get_ua_stylesheet, HTML5_UA_STYLESHEET)
 from ..css import get_all_computed_styles
-from ..css.computed_values import strut_layout
-from ..urls import open_data_url, path2url
+from ..css.computed_values import strut_layout, STRUT_LAYOUT_CACHE
+from ..urls import open_data_url, path2url, PrefetchingURLFetcher
 from .. import CSS, default_url_fetcher
 
 
@@ -69,6 +73,77 @@ def test_style_dict():
         style.position  # pylint: disable=W0104
 
 
+@assert_no_logs
+def test_computed_style():
+    """Test the compact representation of computed styles."""
+    document = TestHTML(string='''
+        <p style="color: red; margin-left: 2px">
+          <em style="margin-left: 3px">a</em><strong>b</strong>
+        </p>
+    ''')
+    style_for = get_all_computed_styles(document)
+    p, = document.root_element.iter('p')
+    em, strong = p
+    p_style = style_for(p)
+    em_style = style_for(em)
+    assert isinstance(p_style, css.ComputedStyle)
+    assert p_style.color == em_style.color == (1, 0, 0, 1)
+    assert p_style.margin_left == (2, 'px')
+    assert em_style.margin_left == (3, 'px')
+    # Inherited values are shared when they are the same.
+    assert em_style._inherited is p_style._inherited
+    assert style_for(strong).font_weight == 700
+    assert style_for(strong)._inherited is not p_style._inherited
+
+    copy = p_style.copy()
+    copy.margin_left = (4, 'px')
+    copy['color'] = 'currentColor'
+    copy['custom'] = 5
+    assert p_style.margin_left == (2, 'px')
+    assert p_style.color == (1, 0, 0, 1)
+    assert 'custom' in copy and 'custom' not in p_style
+    assert copy.custom == 5
+    with raises(KeyError):
+        p_style.custom  # pylint: disable=W0104
+
+    anonymous = p_style.inherit_from()
+    assert anonymous.anonymous and not p_style.anonymous
+    assert anonymous.color == (1, 0, 0, 1)
+    assert anonymous.margin_left == (0, 'px')
+    assert anonymous.border_top_width == 0
+    assert anonymous.copy().anonymous
+
+
+@assert_no_logs
+def test_computed_from_parent():
+    """Test that computing only the cascaded values gives the same styles."""
+    document = TestHTML(string='<p style="color: red"><em>a</em></p>')
+    style_for = get_all_computed_styles(document)
+    p, = document.root_element.iter('p')
+    em, = p
+    parent_style = style_for(p)
+    parent_dict = css.StyleDict(dict(
+        (name, parent_style[name]) for name in css.properties.INITIAL_VALUES))
+    for declarations in [
+            'font-size: 2em; margin: 1em; line-height: 150%',
+            'border-top-style: solid; outline: dotted 2px',
+            'float: left; display: table-cell',
+            'position: absolute; float: right; border-left-width: inherit',
+            'color: inherit; display: inherit; border-right: initial',
+            'display: initial; border-bottom-width: initial',
+            'vertical-align: super; letter-spacing: 1ex; font-weight: bolder',
+            'content: "a" attr(title); text-indent: 3px']:
+        (_rule, _selectors, declarations), = CSS(
+            string='em { %s }' % declarations).rules
+        cascaded = dict(
+            (name, (values, None)) for name, values, _importance
+            in declarations)
+        style = css.computed_from_cascaded(em, cascaded, parent_style)
+        expected = css.computed_from_cascaded(em, cascaded, parent_dict)
+        for name in css.properties.INITIAL_VALUES:
+            assert style[name] == expected[name], name
+
+
 @assert_no_logs
 def test_find_stylesheets():
     """Test if the stylesheets are found in a HTML document."""
@@ -93,6 +168,46 @@ def test_find_stylesheets():
     ]
 
 
+@assert_no_logs
+def test_stylesheet_cache():
+    """Test the process-wide cache of preprocessed stylesheets."""
+    document = TestHTML(resource_filename('doc1.html'))
+    assert css.STYLESHEET_CACHE is None
+    css.set_stylesheet_cache_size(16)
+    try:
+        sheets = list(css.find_stylesheets(
+            document.root_element, 'print', default_url_fetcher))
+        cache = css.STYLESHEET_CACHE
+        # <link>, <style> and the imported stylesheets
+        size = len(cache)
+        assert size > 2
+        assert cache.hits == 0
+        for cached_sheet, sheet in zip(css.find_stylesheets(
+                document.root_element, 'print', default_url_fetcher),
+                sheets):
+            assert cached_sheet is sheet
+        assert cache.hits == 2
+        assert len(cache) == size
+        # The media type is part of the key.
+        screen_sheets = list(css.find_stylesheets(
+            document.root_element, 'screen', default_url_fetcher))
+        assert screen_sheets[0] is not sheets[0]
+        # So is the url_fetcher, unless it only prefetches resources.
+        other_sheets = list(css.find_stylesheets(
+            document.root_element, 'print',
+            lambda url: default_url_fetcher(url)))
+        assert other_sheets[0] is not sheets[0]
+        prefetcher = PrefetchingURLFetcher(default_url_fetcher, 2)
+        try:
+            assert list(css.find_stylesheets(
+                document.root_element, 'print', prefetcher)) == sheets
+        finally:
+            prefetcher.close()
+    finally:
+        css.set_stylesheet_cache_size(None)
+    assert css.STYLESHEET_CACHE is None
+
+
 @assert_no_logs
 def test_expand_shorthands():
     """Test the expand shorthands."""
@@ -203,6 +318,228 @@ def test_annotate_document():
     # pylint: enable=C0103
 
 
+@assert_no_logs
+def test_style_sharing():
+    """Test that siblings with the same cascaded values share their style."""
+    document = TestHTML(string='''
+        <style>
+            td.amount { text-align: right }
+            td:after { content: attr(title) }
+        </style>
+        <table><tr>
+            <td class=amount>1</td><td class=amount>2</td><td>3</td>
+            <td class=amount title=a>4</td><td class=amount lang=fr>5</td>
+        </tr></table>
+    ''')
+    sharing_cache = css.StyleSharingCache()
+    style_for = get_all_computed_styles(
+        document, sharing_cache=sharing_cache)
+    assert sharing_cache.hits > 0
+    td_1, td_2, td_3, td_4, td_5 = document.root_element.iter('td')
+    assert style_for(td_1) is style_for(td_2)
+    assert style_for(td_1) is style_for(td_4)
+    assert style_for(td_1) is not style_for(td_3)
+    assert style_for(td_1).text_align == 'right'
+    # lang: attr(lang) in the user agent stylesheet
+    assert style_for(td_5) is not style_for(td_1)
+    assert style_for(td_5).lang == 'fr'
+    # content: attr(title) depends on the element
+    assert style_for(td_1, 'after') is not style_for(td_4, 'after')
+    assert style_for(td_1, 'after').content == [('STRING', '')]
+    assert style_for(td_4, 'after').content == [('STRING', 'a')]
+
+
+@assert_no_logs
+def test_lazy_pseudo_elements():
+    """Test that pseudo-element styles are computed on demand."""
+    document = TestHTML(string='''
+        <style>
+            p::first-letter { color: red }
+            p::after { content: "a" }
+            td { margin: 2px }
+            td::before { margin: inherit; content: "b" }
+        </style>
+        <p>a</p><p>b</p><table><tr><td>c</td></tr></table>
+    ''')
+    sharing_cache = css.StyleSharingCache()
+    style_for = get_all_computed_styles(
+        document, sharing_cache=sharing_cache)
+    p_1, p_2 = document.root_element.iter('p')
+    td, = document.root_element.iter('td')
+
+    lookups = sharing_cache.hits + sharing_cache.misses
+    after = style_for(p_1, 'after')
+    assert after.content == [('STRING', 'a')]
+    assert sharing_cache.hits + sharing_cache.misses == lookups + 1
+    assert style_for(p_1, 'after') is after
+    assert sharing_cache.hits + sharing_cache.misses == lookups + 1
+    assert style_for(p_2, 'after') is after
+    assert style_for(p_2, 'first-letter').color == (1, 0, 0, 1)
+    assert style_for(p_2, 'before') is None
+
+    # Explicitly inherited non-inherited values are computed on demand too.
+    lookups = sharing_cache.hits + sharing_cache.misses
+    before = style_for(td, 'before')
+    assert sharing_cache.hits + sharing_cache.misses == lookups + 1
+    assert before.margin_top == (2, 'px')
+    # Boxes change copies of the element style, not the style itself.
+    td_style = style_for(td).copy()
+    td_style['margin_top'] = css.properties.Dimension(0, 'px')
+    assert style_for(td).margin_top == (2, 'px')
+    assert style_for(td, 'before') is before
+
+
+@assert_no_logs
+def test_style_attribute_cache():
+    """Test that identical "style" attributes are only validated once."""
+    cache = css.STYLE_ATTRIBUTE_CACHE
+    hits, misses = cache.hits, cache.misses
+    document = TestHTML(string='''
+        <p style="text-align: right; padding: 2px">a</p>
+        <p style="text-align: right; padding: 2px">b</p>
+    ''')
+    style_for = get_all_computed_styles(document)
+    p_1, p_2 = document.root_element.iter('p')
+    # Other tests may have cached the attribute, but the second one is
+    # always found in the cache.
+    assert cache.hits + cache.misses == hits + misses + 2
+    assert cache.hits >= hits + 1
+    assert style_for(p_1).padding_top == style_for(p_2).padding_top == (
+        2, 'px')
+    assert style_for(p_2).text_align == 'right'
+
+    # Attributes with errors are not cached, warnings are logged each time.
+    document = TestHTML(string='''
+        <p style="margin-top: red; text-align: right">a</p>
+        <p style="margin-top: red; text-align: right">b</p>
+    ''')
+    hits = cache.hits
+    with capture_logs() as logs:
+        style_for = get_all_computed_styles(document)
+    assert len(logs) == 2
+    assert cache.hits == hits
+    for p in document.root_element.iter('p'):
+        assert style_for(p).text_align == 'right'
+
+
+@assert_no_logs
+def test_selector_cache():
+    """Test that compiled selectors are shared by stylesheets."""
+    (_rule, selectors_1, _declarations), = CSS(
+        string='ul > li.item, p { color: red }').rules
+    hits = css.SELECTOR_CACHE.hits
+    (_rule, selectors_2, _declarations), = CSS(
+        string='ul > li.item, p { margin: 0 }').rules
+    assert css.SELECTOR_CACHE.hits == hits + 1
+    assert selectors_1 == selectors_2
+    assert selectors_1 is not selectors_2
+    assert selectors_1[0].specificity == (0, 0, 1, 2)
+
+    for _i in range(2):
+        with capture_logs() as logs:
+            CSS(string='p::lipsum { margin: 2cm }')
+        assert len(logs) == 1
+        assert 'WARNING: Invalid or unsupported selector' in logs[0]
+        assert 'Unknown pseudo-element' in logs[0]
+
+
+@assert_no_logs
+def test_ua_stylesheet_cache():
+    """Test the disk cache of user-agent stylesheets."""
+    filename = resource_filename('mini_ua.css')
+    with temp_directory() as cache_directory:
+        stylesheet_1 = load_ua_stylesheet(filename, cache_directory)
+        cache_name, = os.listdir(cache_directory)
+        assert cache_name.startswith('mini_ua-')
+        assert cache_name.endswith('.pickle')
+
+        stylesheet_2 = load_ua_stylesheet(filename, cache_directory)
+        assert stylesheet_2 is not stylesheet_1
+        assert len(stylesheet_2.rules) == len(stylesheet_1.rules)
+        for rule_1, rule_2 in zip(stylesheet_1.rules, stylesheet_2.rules):
+            _, selectors_1, declarations_1 = rule_1
+            _, selectors_2, declarations_2 = rule_2
+            assert [selector.specificity for selector in selectors_1] == [
+                selector.specificity for selector in selectors_2]
+            assert [name for name, _, _ in declarations_1] == [
+                name for name, _, _ in declarations_2]
+        document = TestHTML(string='<p>a</p>')
+        document._ua_stylesheets = lambda: [stylesheet_2]
+        style_for = get_all_computed_styles(document)
+        assert style_for(document.root_element[1][0]).margin_top == (16, 'px')
+
+        # Broken caches are ignored and replaced.
+        with open(os.path.join(cache_directory, cache_name), 'wb') as fd:
+            fd.write(b'lipsum')
+        stylesheet_3 = load_ua_stylesheet(filename, cache_directory)
+        assert len(stylesheet_3.rules) == len(stylesheet_1.rules)
+        assert os.listdir(cache_directory) == [cache_name]
+        with open(os.path.join(cache_directory, cache_name), 'rb') as fd:
+            assert fd.read() != b'lipsum'
+
+    # The cache is disabled by default.
+    with temp_directory() as cache_home:
+        old_cache_home = os.environ.get('XDG_CACHE_HOME')
+        os.environ['XDG_CACHE_HOME'] = cache_home
+        try:
+            stylesheet = load_ua_stylesheet(filename)
+        finally:
+            if old_cache_home is None:
+                del os.environ['XDG_CACHE_HOME']
+            else:
+                os.environ['XDG_CACHE_HOME'] = old_cache_home
+        assert len(stylesheet.rules) == len(stylesheet_1.rules)
+        assert os.listdir(cache_home) == []
+
+    # The compatible attribute gives the stylesheet loaded on first use.
+    assert isinstance(HTML5_UA_STYLESHEET, CSS)
+    assert HTML5_UA_STYLESHEET.rules is get_ua_stylesheet().rules
+
+
+@assert_no_logs
+def test_cascade_profiler():
+    """Test the report of the cascade profiler."""
+    document = TestHTML(string='''
+        <style>
+            p { color: red; margin-left: 2px }
+            p.a, div { color: blue }
+            @page :first { margin: 1cm }
+        </style>
+        <p class=a>a</p><p style="margin-left: 3px">b</p><p>c</p>
+    ''')
+    profiler = css.CascadeProfiler()
+    style_for = get_all_computed_styles(document, profiler=profiler)
+    assert style_for(document.root_element[1][0]).color == (0, 0, 1, 1)
+    report = profiler.report()
+
+    assert [name for name, _time in report['phases']] == [
+        'stylesheets', 'rules', 'matching', 'style attributes',
+        'computed values', 'pseudo-elements']
+    assert all(time >= 0 for _name, time in report['phases'])
+    assert sorted(selector['time'] for selector in report['selectors']) == (
+        [selector['time'] for selector in reversed(report['selectors'])])
+
+    selectors = dict(
+        (selector['selector'], selector)
+        for selector in report['selectors'] if selector['origin'] == 'author')
+    assert sorted(selectors) == ['@page:first', 'div', 'p', 'p.a']
+    p = selectors['p']
+    assert p['line'] == 2
+    assert p['specificity'] == (0, 0, 0, 1)
+    assert (p['tested'], p['matched']) == (3, 3)
+    # color is overridden on the first paragraph, margin-left on the second.
+    assert (p['declarations'], p['applied'], p['overridden']) == (6, 4, 2)
+    p_a = selectors['p.a']
+    # Only the elements with the "a" class are tested.
+    assert (p_a['tested'], p_a['matched']) == (1, 1)
+    assert (p_a['declarations'], p_a['applied'], p_a['overridden']) == (
+        1, 1, 0)
+    assert (selectors['div']['tested'], selectors['div']['matched']) == (0, 0)
+    page = selectors['@page:first']
+    assert (page['matched'], page['declarations'], page['applied']) == (
+        4, 16, 16)
+
+
 @assert_no_logs
 def test_page():
     """Test the ``@page`` properties."""
@@ -341,6 +678,11 @@ def test_line_height_inheritance():
     assert strut_layout(paragraph.style)[0] == 28
     assert paragraph.style.vertical_align == 14  # 50% of 28px
 
+    # Results only depend on the font and line-height, they are cached.
+    hits = STRUT_LAYOUT_CACHE.hits
+    assert strut_layout(paragraph.style.copy())[0] == 28
+    assert STRUT_LAYOUT_CACHE.hits == hits + 1
+
 
 @assert_no_logs
 def test_important():
@@ -378,6 +720,46 @@ def test_important():
         assert paragraph.style.color == (0, 1, 0, 1)  # lime (light green)
 
 
+@assert_no_logs
+def test_rule_index():
+    """Test the index of selectors by their rightmost compound selector."""
+    document = TestHTML(string='''
+        <div id=main class="a  b" lang=fr>
+          <p class=b>1</p><p title=x>2</p><!-- comment --><p>3</p>
+        </div>
+    ''')
+    sheet = CSS(string='''
+        p, .b, #main, [lang|=fr], div p.b, p + p, *, p[title!=x],
+        .a.b, [title], div[title] { color: red }
+    ''')
+    (_rule, selectors, _declarations), = sheet.rules
+    assert [selector.key for selector in selectors] == [
+        ('tag', 'p'), ('class', 'b'), ('id', 'main'), ('attribute', 'lang'),
+        ('class', 'b'), ('tag', 'p'), None, ('tag', 'p'), ('class', 'a'),
+        ('attribute', 'title'), ('attribute', 'title')]
+    # Type, class, id and universal selectors alone need no XPath test.
+    assert [selector.element_match is None for selector in selectors] == [
+        True, True, True, False, False, False, True, False, False, False,
+        False]
+
+    root = document.root_element
+    div = root.find('.//div')
+    p1, p2, p3 = div.findall('p')
+    for selector, expected in zip(selectors, [
+            [p1, p2, p3], [div, p1], [div], [div], [p1], [p2, p3],
+            list(root.iter('*')), [p1, p3], [div], [p2], []]):
+        assert list(selector.match(root)) == expected
+
+    index = css.RuleIndex()
+    for i, selector in enumerate(selectors):
+        index.add(selector, i)
+    assert index.get_rules(p1) == [
+        (None, 0), (None, 1), (None, 4), (None, 6), (None, 7)]
+    assert index.get_rules(p2) == [(None, 0), (None, 5), (None, 6), (None, 9)]
+    assert index.get_rules(div) == [
+        (None, 1), (None, 2), (None, 3), (None, 6), (None, 8)]
+
+
 @assert_no_logs
 def test_units():
     document = TestHTML(string='''
@@ -13,21 +13,25 @@
 from __future__ import division, unicode_literals
 
 import sys
+import base64
 import os.path
 import tempfile
 import shutil
 import itertools
+import threading
 import functools
 
 import cairocffi as cairo
 import pytest
 
 from ..compat import xrange, izip, ints_from_bytes
-from ..urls import ensure_url
+from ..urls import ensure_url, default_url_fetcher, path2url
+from .. import images
 from ..html import HTML_HANDLERS
 from .. import HTML
 from .testing_utils import (
-    resource_filename, TestHTML, FONTS, assert_no_logs, capture_logs)
+    resource_filename, TestHTML, FONTS, assert_no_logs, capture_logs,
+    temp_directory)
 
 
 # RGBA to native-endian ARGB
@@ -1445,6 +1449,75 @@ def test_images():
     ''')
 
 
+@assert_no_logs
+def test_lazy_raster_images():
+    """Test that raster images are only decoded when drawn."""
+    for filename, header in [
+            ('pattern.png', ('png', 4, 4)),
+            ('logo_small.png', ('png', 100, 41)),
+            ('pattern.gif', ('gif', 4, 4)),
+            ('blue.jpg', ('jpeg', 4, 4)),
+            ('pattern.svg', None),
+            ('really-a-svg.png', None)]:
+        with open(resource_filename(filename), 'rb') as fd:
+            assert images.get_raster_size(fd.read()) == header
+
+    url = path2url(resource_filename('logo_small.png'))
+    image = images.get_image_from_uri({}, default_url_fetcher, url)
+    assert isinstance(image, images.LazyRasterImage)
+    assert image.get_intrinsic_size(1) == (100, 41)
+    assert image._image_surface is None
+    # Local files are mapped again when decoded, not copied.
+    assert image._string is None
+    assert image.surface_size == 100 * 41 * 4
+    assert image.image_surface.get_width() == 100
+    assert image.image_surface.get_height() == 41
+
+    # A valid header but no pixels: the image is laid out, but fails to
+    # load when drawn.
+    with open(resource_filename('pattern.png'), 'rb') as fd:
+        header = fd.read(33)
+    url = 'data:image/png;base64,' + base64.b64encode(header).decode('ascii')
+    document = TestHTML(string='<img src="%s">' % url).render()
+    html, = document.pages[0]._page_box.children
+    body, = html.children
+    line, = body.children
+    img, = line.children
+    assert (img.width, img.height) == (4, 4)
+    for _i in range(2):
+        # The failure is reported at each render.
+        with capture_logs() as logs:
+            document.write_png()
+        assert len(logs) == 1
+        assert 'WARNING: Failed to load image' in logs[0]
+
+    # Images are decoded once, even when drawn in parallel.
+    url = path2url(resource_filename('pattern.png'))
+    image = images.get_image_from_uri({}, default_url_fetcher, url)
+    surfaces = []
+    threads = [
+        threading.Thread(target=lambda: surfaces.append(image.image_surface))
+        for _i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(surfaces) == 4
+    assert all(surface is surfaces[0] for surface in surfaces)
+
+    # Local files removed after the layout fail to load when drawn.
+    with temp_directory() as temp:
+        filename = os.path.join(temp, 'logo.png')
+        shutil.copy(resource_filename('logo_small.png'), filename)
+        image = images.get_image_from_uri(
+            {}, default_url_fetcher, path2url(filename))
+        os.remove(filename)
+    with pytest.raises(images.ImageLoadingError):
+        image.image_surface
+    with pytest.raises(images.ImageLoadingError):
+        image.image_surface
+
+
 def test_image_resolution():
     assert_same_rendering(20, 20, [
         ('image_resolution_ref', '''
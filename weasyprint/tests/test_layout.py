@@ -1986,6 +1986,36 @@ def test_orphans_widows_avoid():
         'orphans: 2; widows: 2; page-break-inside: avoid') == [0, 7]
 
 
+@assert_no_logs
+def test_collapsed_table_page_breaks():
+    """Test the top border of collapsed tables on each page."""
+    pages = parse('''
+        <style>
+            @page { size: 120px }
+            table { border-collapse: collapse; table-layout: fixed;
+                    width: 100% }
+            td { height: 40px }
+        </style>
+        <table>
+            <tr style="border-top: 2px solid"><td>row 1</td></tr>
+            <tr><td>row 2</td></tr>
+            <tr style="border-top: 6px solid"><td>row 3</td></tr>
+        </table>
+    ''')
+    tables = []
+    for page in pages:
+        table_wrapper, = body_children(page)
+        table, = table_wrapper.children
+        tables.append(table)
+    assert [len(table.children[0].children) for table in tables] == [2, 1]
+    # Each page keeps the border of its first row, even after the
+    # layout of the next pages.
+    assert tables[0].border_top_width == 1
+    assert tables[0].style.border_top_width == 1
+    assert tables[1].border_top_width == 3
+    assert tables[1].style.border_top_width == 3
+
+
 @assert_no_logs
 def test_table_page_breaks():
     """Test the page breaks inside tables."""
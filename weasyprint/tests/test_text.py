@@ -14,7 +14,13 @@ from __future__ import division, unicode_literals
 
 from ..css import StyleDict
 from ..css.properties import INITIAL_VALUES
-from ..text import split_first_line
+from ..lru import LRUCache
+from ..text import (split_first_line, line_widths, get_layouts_created,
+                    font_key, get_font_description, create_layout,
+                    ParagraphLayout, hyphenate_word, get_hyphenation_fit,
+                    HYPHENATION_CACHE,
+                    TextRun, get_size, preload_fonts, FONT_DESCRIPTION_CACHE)
+from .. import text as text_module
 from .test_layout import parse, body_children
 from .testing_utils import FONTS, assert_no_logs
 
@@ -22,12 +28,17 @@ from .testing_utils import FONTS, assert_no_logs
 FONTS = FONTS.split(', ')
 
 
-def make_text(text, width=None, **style):
-    """Wrapper for split_first_line() creating a StyleDict."""
-    style = StyleDict({
+def make_style(**style):
+    """Return a StyleDict with a monospace font."""
+    return StyleDict({
         'font_family': ['Nimbus Mono L', 'Liberation Mono', 'FreeMono',
                         'monospace'],
     }, INITIAL_VALUES).updated_copy(style)
+
+
+def make_text(text, width=None, **style):
+    """Wrapper for split_first_line() creating a StyleDict."""
+    style = make_style(**style)
     return split_first_line(
         text, style, hinting=False, max_width=width, line_width=None)
 
@@ -120,3 +131,217 @@ def test_text_spaced_inlines():
 
     b1, = b.children
     assert b1.text == 'b1'
+
+
+@assert_no_logs
+def test_layout_pool():
+    """Test that layouts only used for measurement are recycled."""
+    style = make_style(font_size=16)
+    widths = list(line_widths('some text', style, False, None))
+    created = get_layouts_created()
+    for _ in range(10):
+        assert list(line_widths('some text', style, False, None)) == widths
+    assert get_layouts_created() == created
+
+
+@assert_no_logs
+def test_font_description_cache():
+    """Test that layouts with the same font share a font description."""
+    style = make_style(font_size=16)
+    key = font_key(style, 16)
+    assert key == font_key(make_style(font_size=16), 16)
+    assert key != font_key(make_style(font_size=16, font_weight=700), 16)
+    assert get_font_description(key) is get_font_description(key)
+    layout_1 = create_layout('some text', style, False, None)
+    layout_2 = create_layout('other text', style, False, None)
+    assert layout_1.font is layout_2.font
+
+
+@assert_no_logs
+def test_paragraph_layout():
+    """Test that line breaks found in a paragraph layout are the same."""
+    string = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 10
+    style = make_style(font_family=FONTS, font_size=16)
+    paragraph = ParagraphLayout(string, style, False, 150)
+    skip = 0
+    while 1:
+        # ASCII-only: UTF-8 indexes are the same as Unicode indexes.
+        _, length, resume_at, _, _, _ = split_first_line(
+            string[skip:], style, False, 150, None)
+        _, paragraph_length, paragraph_resume_at, _, _, _ = (
+            split_first_line(string[skip:], style, False, 150, None,
+                             paragraph, skip))
+        assert (paragraph_length, paragraph_resume_at) == (length, resume_at)
+        if resume_at is None:
+            break
+        skip += resume_at
+    assert paragraph.lines_used > 1
+
+
+@assert_no_logs
+def test_split_first_line_text_run():
+    """Test that lines are the same when split in the run of the whole text."""
+    string = 'Lor\xe9m ipsum d\xf6lor sit amet, consectetur adipiscing. ' * 5
+    style = make_style(font_family=FONTS, font_size=16, word_spacing=3)
+    text_run = TextRun(string)
+    skip = 0
+    while 1:
+        text = string[skip:]
+        _, length, resume_at, width, _, _ = split_first_line(
+            text, style, False, 150, None)
+        _, run_length, run_resume_at, run_width, _, _ = split_first_line(
+            text, style, False, 150, None, None, 0, text_run,
+            text_run.utf8_index(skip))
+        assert (run_length, run_resume_at, run_width) == (
+            length, resume_at, width)
+        if resume_at is None:
+            break
+        skip += len(text.encode('utf-8')[:resume_at].decode('utf-8'))
+
+
+@assert_no_logs
+def test_hyphenate_word():
+    """Test the cache of hyphenation positions."""
+    parts = hyphenate_word('fr', 2, 2, 5, 'hyphénation')
+    assert parts
+    assert all('hyphénation'.startswith(part) for part in parts)
+    assert list(parts) == sorted(parts, key=len, reverse=True)
+    hits = HYPHENATION_CACHE.hits
+    assert hyphenate_word('fr', 2, 2, 5, 'hyphénation') is parts
+    assert HYPHENATION_CACHE.hits == hits + 1
+    assert hyphenate_word('fr', 2, 2, 5, 'a') == ()
+
+
+@assert_no_logs
+def test_hyphenation_fit():
+    """Test that the hyphenation found fits, in both directions."""
+    style = make_style(font_size=16)
+
+    def width(text):
+        layout = create_layout(text, style, False, None)
+        width, _height = get_size(next(layout.iter_lines()))
+        layout.release()
+        return width
+
+    for first_part, word in (('a ', 'hyphénation'),
+                             ('א ', 'אבגדה')):
+        parts = tuple(word[:length] for length in range(len(word) - 1, 1, -1))
+        # Widths of the parts test the limit of the estimates.
+        for max_width in (20, 40, 60, 80) + tuple(
+                width(first_part + part + style.hyphenate_character)
+                for part in parts):
+            expected = None
+            for part in parts:
+                if width(first_part + part + style.hyphenate_character) <= (
+                        max_width):
+                    expected = part
+                    break
+            assert get_hyphenation_fit(
+                first_part, word, parts, style, False, max_width) == expected
+
+
+@assert_no_logs
+def test_line_widths_cache():
+    """Test the cache of line widths used for preferred widths."""
+    cache = LRUCache()
+    style = make_style(font_size=16)
+    hits, misses = cache.hits, cache.misses
+    widths = line_widths('some text', style, False, 0, cache=cache)
+    assert len(widths) == 2
+    assert line_widths('some text', style, False, 0, cache=cache) is widths
+    assert line_widths('some text', style, False, None, cache=cache) != widths
+    other_style = make_style(font_size=16, letter_spacing=2)
+    assert line_widths('some text', other_style, False, 0, cache=cache) != (
+        widths)
+    # Only the second lookup of the same text, style and width is a hit.
+    assert cache.hits == hits + 1
+    assert cache.misses == misses + 3
+
+
+@assert_no_logs
+def test_font_metrics_cache():
+    """Test that font metrics are cached for each font."""
+    style = make_style(font_size=16)
+    layout_1 = create_layout('some text', style, False, None)
+    layout_2 = create_layout('other text', style, False, None)
+    metrics = layout_1.get_font_metrics()
+    assert layout_2.get_font_metrics() is metrics
+    assert metrics.ascent > 0
+    assert metrics.underline_thickness > 0
+
+
+@assert_no_logs
+def test_text_run():
+    """Test the conversion between Unicode and UTF-8 indexes."""
+    text_run = TextRun('a\xe9\u20ac b')
+    assert text_run.utf8 == 'a\xe9\u20ac b'.encode('utf-8')
+    assert not text_run.is_ascii
+    assert [text_run.utf8_index(i) for i in range(6)] == [0, 1, 3, 6, 7, 8]
+    assert [text_run.unicode_index(i) for i in (0, 1, 3, 6, 7, 8)] == (
+        list(range(6)))
+    assert text_run.slice(1, 6) == '\xe9\u20ac'
+    assert text_run.slice(7) == 'b'
+
+    text_run = TextRun('ascii')
+    assert text_run.is_ascii
+    assert text_run.utf8_index(3) == text_run.unicode_index(3) == 3
+    assert text_run._utf8_indexes is None
+
+    _, length, resume_at, _, _, _ = make_text(
+        '\xe9t\xe9 \xe9t\xe9', width=1, font_size=16)
+    assert (length, resume_at) == (5, 6)
+
+
+@assert_no_logs
+def test_spacing_attributes():
+    """Test that spacing attributes are shared by the layouts of a run."""
+    style = make_style(font_size=16, letter_spacing=2, word_spacing=5)
+    text_run = TextRun('some spaced text')
+    attributes = text_run.spacing_attributes(2048, 5120)
+    assert text_run.spacing_attributes(2048, 5120) is attributes
+    assert text_run.spacing_attributes(0, 5120) is not attributes
+    # Attributes are limited to the part of the text that is laid out.
+    line_attributes = text_run.spacing_attributes(2048, 5120, 5, 11)
+    assert line_attributes is not attributes
+    assert text_run.spacing_attributes(2048, 5120, 5, 8) is line_attributes
+    assert text_run.spacing_attributes(2048, 5120, 5) is not line_attributes
+    for text in ('some spaced text', 'some spaced', 'other text'):
+        layout_1 = create_layout(text, style, False, None, text_run)
+        layout_2 = create_layout(text, style, False, None)
+        width_1, _ = get_size(next(layout_1.iter_lines()))
+        width_2, _ = get_size(next(layout_2.iter_lines()))
+        assert width_1 == width_2
+    for text in ('spaced text', 'spaced'):
+        layout_1 = create_layout(text, style, False, None, text_run, 5)
+        layout_2 = create_layout(text, style, False, None)
+        width_1, _ = get_size(next(layout_1.iter_lines()))
+        width_2, _ = get_size(next(layout_2.iter_lines()))
+        assert width_1 == width_2
+
+
+@assert_no_logs
+def test_preload_fonts():
+    """Test that preloading fonts fills the font caches."""
+    # Start from an empty cache, and restore the shared one afterwards.
+    old_cache = text_module.FONT_METRICS_CACHE
+    text_module.FONT_METRICS_CACHE = cache = LRUCache(maxsize=256)
+    try:
+        assert preload_fonts(
+            [['serif'], 'monospace'], weights=[400], styles=['italic']) == 2
+        key = (('monospace',), 'normal', 'italic', 'normal', 400, 16)
+        assert key in FONT_DESCRIPTION_CACHE
+        assert (key, True) in cache
+        assert (key, False) in cache
+
+        style = make_style(font_family=['monospace'], font_style='italic')
+        hits = cache.hits
+        create_layout('text', style, True, None).get_font_metrics()
+        assert cache.hits == hits + 1
+
+        assert preload_fonts(
+            ['serif'], weights=[400, 700], styles=['normal'],
+            variants=['normal', 'small-caps'], stretches=['condensed']) == 4
+        key = (('serif',), 'small-caps', 'normal', 'condensed', 700, 16)
+        assert (key, False) in cache
+    finally:
+        text_module.FONT_METRICS_CACHE = old_cache
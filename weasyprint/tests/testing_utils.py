@@ -25,6 +25,14 @@ import tempfile
 from .. import HTML, CSS
 from ..logger import LOGGER
 
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
 
 # TODO: find a way to not depend on a specific font
 FONTS = 'Liberation Sans, Arial'
@@ -108,7 +116,12 @@ def http_server(handlers):
         handler = handlers.get(environ['PATH_INFO'])
         if handler:
             status = str('200 OK')
-            response, headers = handler(environ)
+            response = handler(environ)
+            if len(response) == 3:
+                status, response, headers = response
+                status = str(status)
+            else:
+                response, headers = response
             headers = [(str(name), str(value)) for name, value in headers]
         else:
             status = str('404 Not Found')
@@ -130,6 +143,64 @@ def http_server(handlers):
         thread.join()
 
 
+@contextlib.contextmanager
+def keep_alive_http_server(handlers):
+    """Like :func:`http_server`, with persistent HTTP/1.1 connections.
+
+    Also give a list of the client addresses of the accepted connections.
+
+    """
+    connections = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = str('HTTP/1.1')
+
+        def setup(self):
+            BaseHTTPRequestHandler.setup(self)
+            connections.append(self.client_address)
+
+        def do_GET(self):
+            path, _, query = self.path.partition('?')
+            environ = dict(
+                ('HTTP_' + name.upper().replace('-', '_'), value)
+                for name, value in self.headers.items())
+            environ.update(PATH_INFO=path, QUERY_STRING=query)
+            handler = handlers.get(path)
+            if handler:
+                response = handler(environ)
+                if len(response) == 3:
+                    status, response, headers = response
+                else:
+                    status = '200 OK'
+                    response, headers = response
+            else:
+                status, response, headers = '404 Not Found', b'', []
+            code, reason = status.split(' ', 1)
+            self.send_response(int(code), reason)
+            for name, value in headers:
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    # Port 0: let the OS pick an available port number
+    server = Server(('127.0.0.1', 0), Handler)
+    _host, port = server.socket.getsockname()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:%s' % port, connections
+    finally:
+        server.shutdown()
+        thread.join()
+
+
 @contextlib.contextmanager
 def temp_directory():
     """Context manager that gives the path to a new temporary directory.
@@ -13,11 +13,17 @@
 from __future__ import division
 # XXX No unicode_literals, cffi likes native strings
 
+import bisect
+import itertools
+import threading
+import unicodedata
+
 import pyphen
 import cffi
 import cairocffi as cairo
 
 from .compat import basestring
+from .lru import LRUCache
 
 
 ffi = cffi.FFI()
@@ -162,6 +168,13 @@ ffi.cdef('''
         PangoLayoutLine *line,
         PangoRectangle *ink_rect, PangoRectangle *logical_rect);
 
+    void pango_layout_get_extents (
+        PangoLayout *layout,
+        PangoRectangle *ink_rect, PangoRectangle *logical_rect);
+
+    void pango_layout_index_to_pos (
+        PangoLayout *layout, int index_, PangoRectangle *pos);
+
     PangoContext *      pango_layout_get_context    (PangoLayout *layout);
     PangoFontMetrics *  pango_context_get_metrics   (
         PangoContext *context, const PangoFontDescription *desc,
@@ -214,6 +227,20 @@ units_from_double = pango.pango_units_from_double
 
 PYPHEN_DICTIONARY_CACHE = {}
 
+# Keys are ``(lang, left, right, word)``,
+# values are the possible first parts of the hyphenated word, longest first.
+HYPHENATION_CACHE = LRUCache(maxsize=4096)
+
+# Maximum number of lines found at once by a ParagraphLayout
+PARAGRAPH_LINES = 10
+
+# Keys are the values returned by font_key(),
+# values are PangoFontDescription pointers.
+FONT_DESCRIPTION_CACHE = LRUCache(maxsize=256)
+
+# Keys are ``(font_key(), hinting)``, values are FontMetrics objects.
+FONT_METRICS_CACHE = LRUCache(maxsize=256)
+
 
 PANGO_STYLE = {
     'normal': pango.PANGO_STYLE_NORMAL,
@@ -245,8 +272,111 @@ PANGO_WRAP_MODE = {
 }
 
 
-def utf8_slice(string, slice_):
-    return string.encode('utf-8')[slice_].decode('utf-8')
+class TextRun(object):
+    """Unicode text and its UTF-8 encoding.
+
+    Pango works with UTF-8 indexes. Encode the text only once, and convert
+    between Unicode and UTF-8 indexes without encoding it again.
+
+    """
+    def __init__(self, text):
+        self.text = text
+        self.utf8 = text.encode('utf-8')
+        # Indexes are the same for ASCII-only text.
+        self.is_ascii = len(self.utf8) == len(text)
+        self._utf8_indexes = None
+        self._spacing_attributes = {}
+
+    def _get_utf8_indexes(self):
+        """Return the list of UTF-8 indexes for each Unicode index."""
+        if self._utf8_indexes is None:
+            utf8_indexes = [0]
+            utf8_index = 0
+            for character in self.text:
+                code_point = ord(character)
+                if code_point < 0x80:
+                    utf8_index += 1
+                elif code_point < 0x800:
+                    utf8_index += 2
+                elif 0xD800 <= code_point < 0xDC00:
+                    # High surrogate on "narrow" Python builds: the whole
+                    # surrogate pair is encoded in 4 bytes.
+                    utf8_index += 4
+                elif 0xDC00 <= code_point < 0xE000:
+                    # Low surrogate, already counted.
+                    pass
+                elif code_point < 0x10000:
+                    utf8_index += 3
+                else:
+                    utf8_index += 4
+                utf8_indexes.append(utf8_index)
+            self._utf8_indexes = utf8_indexes
+        return self._utf8_indexes
+
+    def utf8_index(self, index):
+        """Return the UTF-8 index for the Unicode ``index``."""
+        if self.is_ascii:
+            return index
+        return self._get_utf8_indexes()[index]
+
+    def unicode_index(self, utf8_index):
+        """Return the Unicode index for the UTF-8 ``utf8_index``."""
+        if self.is_ascii:
+            return utf8_index
+        return bisect.bisect_left(self._get_utf8_indexes(), utf8_index)
+
+    def slice(self, start=None, stop=None):
+        """Return the Unicode text between two UTF-8 indexes."""
+        return self.utf8[start:stop].decode('utf-8')
+
+    def spacing_attributes(self, letter_spacing, word_spacing, start=0,
+                           stop=None):
+        """Return a ``PangoAttrList`` for the spacing of the text.
+
+        The list covers the text between the UTF-8 indexes ``start`` and
+        ``stop``, and is valid for any layout whose text is a prefix of this
+        part. It is kept for each pair of spacings, and reused by the
+        following layouts of the same line when they are not longer.
+
+        """
+        if stop is None:
+            stop = len(self.utf8)
+        key = (letter_spacing, word_spacing)
+        cached = self._spacing_attributes.get(key)
+        if cached is not None:
+            cached_start, cached_stop, attr_list = cached
+            if cached_start == start and cached_stop >= stop:
+                return attr_list
+        attr_list = create_spacing_attributes(
+            self.utf8[start:stop], letter_spacing, word_spacing)
+        self._spacing_attributes[key] = start, stop, attr_list
+        return attr_list
+
+
+def create_spacing_attributes(text_bytes, letter_spacing, word_spacing):
+    """Return a new ``PangoAttrList`` with letter and word spacings.
+
+    :param text_bytes: the UTF-8 text of the layout
+    :param letter_spacing: letter spacing in Pango units
+    :param word_spacing: word spacing in Pango units
+
+    """
+    space_spacing = word_spacing + letter_spacing
+    attr_list = ffi.gc(
+        pango.pango_attr_list_new(), pango.pango_attr_list_unref)
+
+    def add_attr(start, end, spacing):
+        attr = pango.pango_attr_letter_spacing_new(spacing)
+        attr.start_index = start
+        attr.end_index = end
+        pango.pango_attr_list_insert(attr_list, attr)
+
+    add_attr(0, len(text_bytes) + 1, letter_spacing)
+    position = text_bytes.find(b' ')
+    while position != -1:
+        add_attr(position, position + 1, space_spacing)
+        position = text_bytes.find(b' ', position + 1)
+    return attr_list
 
 
 def unicode_to_char_p(string):
@@ -272,13 +402,13 @@ def get_ink_position(line):
     return (units_to_double(ink_extents.x), units_to_double(ink_extents.y))
 
 
-def first_line_metrics(first_line, text, layout, resume_at, hyphenated=False):
+def first_line_metrics(first_line, layout, resume_at, hyphenated=False):
     length = first_line.length
     if not hyphenated:
-        first_line_text = utf8_slice(text, slice(length))
-        if first_line_text.endswith(' ') and resume_at:
+        first_line_bytes = layout.text_bytes[:length]
+        if first_line_bytes.endswith(b' ') and resume_at:
             # Remove trailing spaces
-            layout.set_text(first_line_text.rstrip(' '))
+            layout.set_utf8(first_line_bytes.rstrip(b' '))
             first_line = next(layout.iter_lines(), None)
             length = first_line.length if first_line is not None else 0
     width, height = get_size(first_line)
@@ -288,34 +418,126 @@ def first_line_metrics(first_line, text, layout, resume_at, hyphenated=False):
     return layout, length, resume_at, width, height, baseline
 
 
-class Layout(object):
-    """Object holding PangoLayout-related cdata pointers."""
-    def __init__(self, hinting, font_size, style):
-        self.dummy_context = (
-            cairo.Context(cairo.ImageSurface(cairo.FORMAT_ARGB32, 1, 1))
-            if hinting else
-            cairo.Context(cairo.PDFSurface(None, 1, 1)))
-        self.layout = ffi.gc(
+class LayoutPool(threading.local):
+    """Per-thread pool of measurement contexts and Pango layouts.
+
+    Creating a cairo surface and context for every layout is expensive,
+    especially for PDF surfaces. Keep one dummy context per hinting mode
+    and recycle layouts that were only used for measurement.
+
+    cairo and Pango objects are not thread-safe: each thread gets its own
+    pool.
+
+    """
+    #: Maximum number of free layouts kept for each hinting mode.
+    max_free_layouts = 16
+
+    def __init__(self):
+        self.contexts = {}
+        self.free_layouts = {True: [], False: []}
+        #: Number of Pango layouts allocated by this thread.
+        self.layouts_created = 0
+
+    def get_context(self, hinting):
+        """Return the dummy cairo context used to measure text."""
+        hinting = bool(hinting)
+        context = self.contexts.get(hinting)
+        if context is None:
+            context = self.contexts[hinting] = (
+                cairo.Context(cairo.ImageSurface(cairo.FORMAT_ARGB32, 1, 1))
+                if hinting else
+                cairo.Context(cairo.PDFSurface(None, 1, 1)))
+        return context
+
+    def acquire(self, hinting):
+        """Return a PangoLayout pointer with default settings."""
+        hinting = bool(hinting)
+        free_layouts = self.free_layouts[hinting]
+        if free_layouts:
+            layout = free_layouts.pop()
+            # Reset what Layout and create_layout may have changed.
+            pango.pango_layout_set_attributes(layout, ffi.NULL)
+            pango.pango_layout_set_width(layout, -1)
+            pango.pango_layout_set_wrap(layout, pango.PANGO_WRAP_WORD)
+            return layout
+        self.layouts_created += 1
+        return ffi.gc(
             pangocairo.pango_cairo_create_layout(ffi.cast(
-                'cairo_t *', self.dummy_context._pointer)),
+                'cairo_t *', self.get_context(hinting)._pointer)),
             gobject.g_object_unref)
-        self.font = font = ffi.gc(
+
+    def release(self, hinting, layout):
+        """Give back a PangoLayout pointer that is not used anymore."""
+        free_layouts = self.free_layouts[bool(hinting)]
+        if len(free_layouts) < self.max_free_layouts:
+            free_layouts.append(layout)
+
+
+LAYOUT_POOL = LayoutPool()
+
+
+def get_layouts_created():
+    """Return the number of Pango layouts allocated by the current thread.
+
+    Compare values taken before and after a render to know how many layouts
+    the render allocated.
+
+    """
+    return LAYOUT_POOL.layouts_created
+
+
+def font_key(style, font_size):
+    """Return a hashable key for the font properties of ``style``."""
+    assert not isinstance(style.font_family, basestring), (
+        'font_family should be a list')
+    return (tuple(style.font_family), style.font_variant, style.font_style,
+            style.font_stretch, style.font_weight, font_size)
+
+
+def get_font_description(key):
+    """Return a PangoFontDescription pointer for the given ``font_key()``.
+
+    Descriptions are cached and shared: they must not be modified.
+
+    """
+    font = FONT_DESCRIPTION_CACHE.get(key)
+    if font is None:
+        family, variant, style, stretch, weight, font_size = key
+        font = ffi.gc(
             pango.pango_font_description_new(),
             pango.pango_font_description_free)
-        assert not isinstance(style.font_family, basestring), (
-            'font_family should be a list')
-        family_p, family = unicode_to_char_p(','.join(style.font_family))
+        family_p, family = unicode_to_char_p(','.join(family))
         pango.pango_font_description_set_family(font, family_p)
-        pango.pango_font_description_set_variant(
-            font, PANGO_VARIANT[style.font_variant])
-        pango.pango_font_description_set_style(
-            font, PANGO_STYLE[style.font_style])
-        pango.pango_font_description_set_stretch(
-            font, PANGO_STRETCH[style.font_stretch])
-        pango.pango_font_description_set_weight(font, style.font_weight)
+        pango.pango_font_description_set_variant(font, PANGO_VARIANT[variant])
+        pango.pango_font_description_set_style(font, PANGO_STYLE[style])
+        pango.pango_font_description_set_stretch(font, PANGO_STRETCH[stretch])
+        pango.pango_font_description_set_weight(font, weight)
         pango.pango_font_description_set_absolute_size(
             font, units_from_double(font_size))
-        pango.pango_layout_set_font_description(self.layout, font)
+        FONT_DESCRIPTION_CACHE[key] = font
+    return font
+
+
+class Layout(object):
+    """Object holding PangoLayout-related cdata pointers."""
+    def __init__(self, hinting, font_size, style):
+        self.hinting = hinting
+        self.layout = LAYOUT_POOL.acquire(hinting)
+        self.font_key = font_key(style, font_size)
+        # Pango copies the description, but keep a reference for metrics.
+        self.font = get_font_description(self.font_key)
+        pango.pango_layout_set_font_description(self.layout, self.font)
+
+    def release(self):
+        """Give the PangoLayout back to the pool.
+
+        Only call this on layouts that are not referenced anymore,
+        typically the ones used to measure text. The object can not be used
+        after that.
+
+        """
+        LAYOUT_POOL.release(self.hinting, self.layout)
+        self.layout = None
 
     def iter_lines(self):
         layout_iter = ffi.gc(
@@ -327,38 +549,116 @@ class Layout(object):
                 return
 
     def set_text(self, text):
-        text, bytestring = unicode_to_char_p(text)
-        self.text = text
+        self.set_utf8(text.encode('utf-8'))
+
+    def set_utf8(self, bytestring):
+        """Like :meth:`set_text`, with text already encoded in UTF-8."""
+        if b'\x00' in bytestring:
+            bytestring = bytestring.replace(b'\x00', b'')
         self.text_bytes = bytestring
-        pango.pango_layout_set_text(self.layout, text, -1)
+        # Pango copies the text, no need for a cdata buffer.
+        pango.pango_layout_set_text(
+            self.layout, bytestring, len(bytestring))
 
     def get_font_metrics(self):
-        context = pango.pango_layout_get_context(self.layout)
-        return FontMetrics(context, self.font)
+        """Return a :class:`FontMetrics` object, cached for each font."""
+        key = self.font_key, bool(self.hinting)
+        metrics = FONT_METRICS_CACHE.get(key)
+        if metrics is None:
+            context = pango.pango_layout_get_context(self.layout)
+            metrics = FONT_METRICS_CACHE[key] = FontMetrics(context, self.font)
+        return metrics
 
     def set_wrap(self, wrap_mode):
         pango.pango_layout_set_wrap(self.layout, wrap_mode)
 
 
 class FontMetrics(object):
+    """Metrics of a font, in pixels."""
     def __init__(self, context, font):
-        self.metrics = ffi.gc(
-            pango.pango_context_get_metrics(context, font, ffi.NULL),
-            pango.pango_font_metrics_unref)
-
-    def __dir__(self):
-        return ['ascent', 'descent',
-                'approximate_char_width', 'approximate_digit_width',
-                'underline_thickness', 'underline_position',
-                'strikethrough_thickness', 'strikethrough_position']
+        metrics = pango.pango_context_get_metrics(context, font, ffi.NULL)
+        self.ascent = units_to_double(
+            pango.pango_font_metrics_get_ascent(metrics))
+        self.descent = units_to_double(
+            pango.pango_font_metrics_get_descent(metrics))
+        self.approximate_char_width = units_to_double(
+            pango.pango_font_metrics_get_approximate_char_width(metrics))
+        self.approximate_digit_width = units_to_double(
+            pango.pango_font_metrics_get_approximate_digit_width(metrics))
+        self.underline_thickness = units_to_double(
+            pango.pango_font_metrics_get_underline_thickness(metrics))
+        self.underline_position = units_to_double(
+            pango.pango_font_metrics_get_underline_position(metrics))
+        self.strikethrough_thickness = units_to_double(
+            pango.pango_font_metrics_get_strikethrough_thickness(metrics))
+        self.strikethrough_position = units_to_double(
+            pango.pango_font_metrics_get_strikethrough_position(metrics))
+        pango.pango_font_metrics_unref(metrics)
+
+
+def preload_fonts(families=(('serif',), ('sans-serif',), ('monospace',)),
+                  weights=(400, 700), styles=('normal', 'italic'),
+                  variants=('normal',), stretches=('normal',),
+                  font_size=16, sample_text='Aa0'):
+    """Load fonts before the first render.
+
+    The first layout of a process initializes fontconfig and the Pango font
+    map, and each new font is then looked up and loaded. Call this function
+    once at startup, for example in a pre-fork hook of a worker server, to
+    pay this price before the first document is rendered.
+
+    Font descriptions and font metrics are cached for every combination of
+    ``families``, ``weights``, ``styles``, ``variants`` and ``stretches``,
+    with and without hinting. The fonts are not read from stylesheets: give
+    the values used by the documents to render, the defaults only cover the
+    normal variant and stretch of the generic families.
+
+    Descriptions and metrics are cached for a given font size: fonts used at
+    other sizes are loaded, but their descriptions and metrics are computed
+    again on first use.
+
+    :param families:
+        A list of ``font-family`` values, each one being a list of family
+        names.
+    :param weights: A list of numeric ``font-weight`` values.
+    :param styles:
+        A list of ``font-style`` values: ``normal``, ``italic`` or
+        ``oblique``.
+    :param variants:
+        A list of ``font-variant`` values: ``normal`` or ``small-caps``.
+    :param stretches: A list of ``font-stretch`` keyword values.
+    :param font_size: The font size of the cached metrics, in pixels.
+    :param sample_text: Text laid out with each font to load its glyphs.
+    :returns: The number of font descriptions that have been loaded.
 
-    def __getattr__(self, key):
-        if key in dir(self):
-            return units_to_double(
-                getattr(pango, 'pango_font_metrics_get_' + key)(self.metrics))
-
-
-def create_layout(text, style, hinting, max_width):
+    """
+    text_bytes = sample_text.encode('utf-8')
+    count = 0
+    for family in families:
+        if isinstance(family, basestring):
+            family = [family]
+        for key in itertools.product(
+                [tuple(family)], variants, styles, stretches, weights,
+                [font_size]):
+            font = get_font_description(key)
+            for hinting in (False, True):
+                layout = LAYOUT_POOL.acquire(hinting)
+                pango.pango_layout_set_font_description(layout, font)
+                pango.pango_layout_set_text(
+                    layout, text_bytes, len(text_bytes))
+                # Getting the size shapes the text with the font.
+                pango.pango_layout_get_extents(layout, ffi.NULL, ffi.NULL)
+                metrics_key = key, hinting
+                if metrics_key not in FONT_METRICS_CACHE:
+                    FONT_METRICS_CACHE[metrics_key] = FontMetrics(
+                        pango.pango_layout_get_context(layout), font)
+                LAYOUT_POOL.release(hinting, layout)
+            count += 1
+    return count
+
+
+def create_layout(text, style, hinting, max_width, text_run=None,
+                  text_run_start=0):
     """Return an opaque Pango layout with default Pango line-breaks.
 
     :param text: Unicode
@@ -367,6 +667,10 @@ def create_layout(text, style, hinting, max_width):
     :param max_width:
         The maximum available width in the same unit as ``style.font_size``,
         or ``None`` for unlimited width.
+    :param text_run:
+        An optional :class:`TextRun` whose text contains ``text`` at the
+        UTF-8 index ``text_run_start``. Its spacing attributes are shared by
+        the layouts created with it.
 
     """
     layout = Layout(hinting, style.font_size, style)
@@ -382,27 +686,144 @@ def create_layout(text, style, hinting, max_width):
         letter_spacing = 0
     if text and (word_spacing != 0 or letter_spacing != 0):
         letter_spacing = units_from_double(letter_spacing)
-        space_spacing = units_from_double(word_spacing) + letter_spacing
-        attr_list = pango.pango_attr_list_new()
-
-        def add_attr(start, end, spacing):
-            attr = pango.pango_attr_letter_spacing_new(spacing)
-            attr.start_index = start
-            attr.end_index = end
-            pango.pango_attr_list_insert(attr_list, attr)
-
+        word_spacing = units_from_double(word_spacing)
         text_bytes = layout.text_bytes
-        add_attr(0, len(text_bytes) + 1, letter_spacing)
-        position = text_bytes.find(b' ')
-        while position != -1:
-            add_attr(position, position + 1, space_spacing)
-            position = text_bytes.find(b' ', position + 1)
+        if text_run is not None and text_run.utf8.startswith(
+                text_bytes, text_run_start):
+            # Spaces are at the same positions in the text of the run.
+            attr_list = text_run.spacing_attributes(
+                letter_spacing, word_spacing, text_run_start,
+                text_run_start + len(text_bytes))
+        else:
+            attr_list = create_spacing_attributes(
+                text_bytes, letter_spacing, word_spacing)
+        # The layout keeps its own reference to the list.
         pango.pango_layout_set_attributes(layout.layout, attr_list)
-        pango.pango_attr_list_unref(attr_list)
     return layout
 
 
-def split_first_line(text, style, hinting, max_width, line_width):
+class ParagraphLayout(object):
+    """Line breaks for the text of a text box, found with a single layout.
+
+    Lay out up to ``PARAGRAPH_LINES`` lines of ``text`` at once, so that
+    consecutive lines of the same text box do not lay out the remaining text
+    again for each line.
+
+    :attr line_starts:
+        A dict whose keys are the UTF-8 indexes of the first character of
+        known lines, and values are the UTF-8 indexes of the next lines, or
+        ``None`` for the last line of the text.
+
+    ``text_run`` and ``text_run_start`` are passed to :func:`create_layout`.
+
+    """
+    def __init__(self, text, style, hinting, max_width, text_run=None,
+                 text_run_start=0):
+        self.max_width = max_width
+        #: Number of lines found in this layout by split_first_line()
+        self.lines_used = 0
+        # Same as in split_first_line()
+        max_width += style.font_size * 0.2
+        expected_length = int(max_width / style.font_size * 2.5)
+        truncated = expected_length * PARAGRAPH_LINES < len(text)
+        if truncated:
+            text = text[:expected_length * PARAGRAPH_LINES]
+        layout = create_layout(
+            text, style, hinting, max_width, text_run, text_run_start)
+        line_starts = [line.start_index for line in layout.iter_lines()]
+        layout.release()
+        next_starts = line_starts[1:]
+        if truncated:
+            # The last line may be cut in the middle of a word.
+            line_starts.pop()
+        else:
+            next_starts.append(None)
+        self.line_starts = dict(zip(line_starts, next_starts))
+
+
+def hyphenate_word(lang, left, right, total, word):
+    """Return the possible first parts of hyphenated ``word``, longest first.
+
+    Results are cached for each word.
+
+    """
+    key = (lang, left, right, word)
+    first_word_parts = HYPHENATION_CACHE.get(key)
+    if first_word_parts is None:
+        dictionary_key = (lang, left, right, total)
+        dictionary = PYPHEN_DICTIONARY_CACHE.get(dictionary_key)
+        if dictionary is None:
+            dictionary = pyphen.Pyphen(lang=lang, left=left, right=right)
+            PYPHEN_DICTIONARY_CACHE[dictionary_key] = dictionary
+        first_word_parts = tuple(
+            first_word_part
+            for first_word_part, _ in dictionary.iterate(word))
+        HYPHENATION_CACHE[key] = first_word_parts
+    return first_word_parts
+
+
+def get_hyphenation_fit(first_part, word, first_word_parts, style, hinting,
+                        max_width, text_run=None, text_run_start=0):
+    """Return the longest of ``first_word_parts`` fitting in ``max_width``.
+
+    Return ``None`` if none of ``first_part + first_word_part`` followed by
+    the hyphenate character fits.
+
+    For left-to-right text, candidates are first estimated with the
+    positions of their last character in a single layout of
+    ``first_part + word``. Candidates wider than ``max_width`` even without
+    the hyphenate character are skipped, the others are laid out again to
+    check their real width. ``text_run`` and ``text_run_start`` are passed
+    to :func:`create_layout`.
+
+    Unlike the previous search in :func:`split_first_line`, a candidate
+    that is a single line wider than ``max_width`` is never returned: the
+    caller chooses the shortest candidate when nothing fits.
+
+    """
+    if not first_word_parts:
+        return None
+    layout = create_layout(
+        first_part + word, style, hinting, None, text_run, text_run_start)
+    lines = layout.iter_lines()
+    next(lines)
+    if next(lines, None) is not None:
+        # first_part ends with a forced line break, don't hyphenate.
+        layout.release()
+        return None
+    # Positions are logical widths only when all the text is left-to-right.
+    left_to_right = not any(
+        unicodedata.bidirectional(character) in ('R', 'AL', 'AN')
+        for character in first_part + word)
+    if left_to_right:
+        position = ffi.new('PangoRectangle *')
+    result = None
+    for first_word_part in first_word_parts:
+        if left_to_right and word.startswith(first_word_part):
+            index = len((first_part + first_word_part).encode('utf-8'))
+            pango.pango_layout_index_to_pos(layout.layout, index, position)
+            # Shaping at the break point may make the real width a bit
+            # smaller than the estimate, only skip parts that are too wide
+            # even without the hyphenate character.
+            if units_to_double(position.x) > max_width:
+                continue
+        # Shaping and kerning may change at the break point, and
+        # non-standard hyphenation changes the end of the first part.
+        temp_layout = create_layout(
+            first_part + first_word_part + style.hyphenate_character,
+            style, hinting, None, text_run, text_run_start)
+        width, _height = get_size(next(temp_layout.iter_lines()))
+        temp_layout.release()
+        if width <= max_width:
+            result = first_word_part
+            break
+    layout.release()
+    return result
+
+
+def split_first_line(text, style, hinting, max_width, line_width,
+                     paragraph=None, paragraph_index=0, text_run=None,
+                     text_run_start=0):
     """Fit as much as possible in the available width for one line of text.
 
     Return ``(layout, length, resume_at, width, height, baseline)``.
@@ -417,6 +838,15 @@ def split_first_line(text, style, hinting, max_width, line_width):
     ``height``: height in pixels of the first line
     ``baseline``: baseline in pixels of the first line
 
+    If ``paragraph`` is a :class:`ParagraphLayout` for the same
+    ``max_width`` and a text in which ``text`` starts at the UTF-8 index
+    ``paragraph_index``, use its line breaks instead of laying out the whole
+    ``text``.
+
+    If ``text_run`` is a :class:`TextRun` whose text contains ``text`` at the
+    UTF-8 index ``text_run_start``, use it instead of encoding ``text``
+    again.
+
     """
     # In some cases (shrink-to-fit result being the preferred width)
     # this value is coming from Pango itself,
@@ -424,16 +854,36 @@ def split_first_line(text, style, hinting, max_width, line_width):
     #   width2 = (width + X) - X   # in some cases, width2 < width
     # Increase the value a bit to compensate and not introduce
     # an unexpected line break.
+    if text_run is None:
+        text_run = TextRun(text)
+        text_run_start = 0
+    start = text_run_start
+    use_paragraph = (
+        paragraph is not None and paragraph.max_width == max_width and
+        paragraph_index in paragraph.line_starts)
     if max_width is not None:
         max_width += style.font_size * 0.2
     # Step #1: Get a draft layout with the first line
     layout = None
-    if max_width:
+    if use_paragraph:
+        # The line break is already known, only lay out this line.
+        paragraph.lines_used += 1
+        resume_at = paragraph.line_starts[paragraph_index]
+        if resume_at is not None:
+            resume_at -= paragraph_index
+            first_line_text = text_run.slice(start, start + resume_at)
+        else:
+            first_line_text = text
+        layout = create_layout(
+            first_line_text, style, hinting, max_width, text_run, start)
+        first_line = next(layout.iter_lines(), None)
+    elif max_width:
         expected_length = int(max_width / style.font_size * 2.5)
         if expected_length < len(text):
             # Try to use a small amount of text instead of the whole text
             layout = create_layout(
-                text[:expected_length], style, hinting, max_width)
+                text[:expected_length], style, hinting, max_width,
+                text_run, start)
             lines = layout.iter_lines()
             first_line = next(lines, None)
             second_line = next(lines, None)
@@ -441,28 +891,31 @@ def split_first_line(text, style, hinting, max_width, line_width):
                 # The small amount of text fits in one line, give up and use
                 # the whole text
                 layout = None
+            else:
+                resume_at = second_line.start_index
     if layout is None:
-        layout = create_layout(text, style, hinting, max_width)
+        layout = create_layout(
+            text, style, hinting, max_width, text_run, start)
         lines = layout.iter_lines()
         first_line = next(lines, None)
         second_line = next(lines, None)
-    resume_at = None if second_line is None else second_line.start_index
+        resume_at = None if second_line is None else second_line.start_index
 
     # Step #2: Don't hyphenize when it's not needed
     if max_width is None:
         # The first line can take all the place needed
-        return first_line_metrics(first_line, text, layout, resume_at)
+        return first_line_metrics(first_line, layout, resume_at)
     first_line_width, _height = get_size(first_line)
-    if second_line is None and first_line_width <= max_width:
+    if resume_at is None and first_line_width <= max_width:
         # The first line fits in the available width
-        return first_line_metrics(first_line, text, layout, resume_at)
+        return first_line_metrics(first_line, layout, resume_at)
 
     # Step #3: Try to put the first word of the second line on the first line
     if first_line_width <= max_width:
         # The first line may have been cut too early by Pango
-        second_line_index = second_line.start_index
-        first_part = utf8_slice(text, slice(second_line_index))
-        second_part = utf8_slice(text, slice(second_line_index, None))
+        second_line_index = resume_at
+        first_part = text_run.slice(start, start + second_line_index)
+        second_part = text_run.slice(start + second_line_index)
     else:
         # The first word is longer than the line, try to hyphenize it
         first_part = ''
@@ -471,10 +924,13 @@ def split_first_line(text, style, hinting, max_width, line_width):
 
     if not next_word:
         # We did not find a word on the next line
-        return first_line_metrics(first_line, text, layout, resume_at)
+        return first_line_metrics(first_line, layout, resume_at)
 
     # next_word might fit without a space afterwards.
     # Pango previously counted that space’s advance width.
+    # This is also true for line breaks given by ``paragraph``, and the
+    # hyphenation below needs the width of this layout: keep this step
+    # for them.
     new_first_line = first_part + next_word
     layout.set_text(new_first_line)
     lines = layout.iter_lines()
@@ -484,7 +940,7 @@ def split_first_line(text, style, hinting, max_width, line_width):
     if second_line is None and first_line_width <= max_width:
         # The next word fits in the first line, keep the layout
         resume_at = len(new_first_line.encode('utf-8')) + 1
-        return first_line_metrics(first_line, text, layout, resume_at)
+        return first_line_metrics(first_line, layout, resume_at)
 
     # Step #4: Try to hyphenize
     hyphens = style.hyphens
@@ -504,30 +960,26 @@ def split_first_line(text, style, hinting, max_width, line_width):
 
         if space > limit_zone or space < 0:
             # The next word does not fit, try hyphenation
-            dictionary_key = (lang, left, right, total)
-            dictionary = PYPHEN_DICTIONARY_CACHE.get(dictionary_key)
-            if dictionary is None:
-                dictionary = pyphen.Pyphen(lang=lang, left=left, right=right)
-                PYPHEN_DICTIONARY_CACHE[dictionary_key] = dictionary
-            for first_word_part, _ in dictionary.iterate(next_word):
+            first_word_parts = hyphenate_word(
+                lang, left, right, total, next_word)
+            first_word_part = get_hyphenation_fit(
+                first_part, next_word, first_word_parts, style, hinting,
+                max_width, text_run, start)
+            if first_word_part is None and space < 0 and first_word_parts:
+                # Nothing fits, use the shortest part
+                first_word_part = first_word_parts[-1]
+            if first_word_part is not None:
+                hyphenated = True
                 new_first_line = (
                     first_part + first_word_part + style.hyphenate_character)
-                temp_layout = create_layout(
-                    new_first_line, style, hinting, max_width)
-                temp_lines = temp_layout.iter_lines()
-                temp_first_line = next(temp_lines, None)
-                temp_second_line = next(temp_lines, None)
-
-                if (temp_second_line is None and space >= 0) or space < 0:
-                    hyphenated = True
-                    # TODO: find why there's no need to .encode
-                    resume_at = len(first_part + first_word_part)
-                    layout = temp_layout
-                    first_line = temp_first_line
-                    second_line = temp_second_line
-                    temp_first_line_width, _height = get_size(temp_first_line)
-                    if temp_first_line_width <= max_width:
-                        break
+                # TODO: find why there's no need to .encode
+                resume_at = len(first_part + first_word_part)
+                layout = create_layout(
+                    new_first_line, style, hinting, max_width,
+                    text_run, start)
+                lines = layout.iter_lines()
+                first_line = next(lines, None)
+                second_line = next(lines, None)
 
     # Step 5: Try to break word if it's too long for the line
     overflow_wrap = style.overflow_wrap
@@ -541,7 +993,7 @@ def split_first_line(text, style, hinting, max_width, line_width):
                 new_first_line[-(len(style.hyphenate_character)):])
             if second_line is not None:
                 second_line_index = second_line.start_index
-                second_part = utf8_slice(text, slice(second_line_index, None))
+                second_part = text_run.slice(start + second_line_index)
                 new_first_line += second_part
             hyphenated = False
 
@@ -551,29 +1003,47 @@ def split_first_line(text, style, hinting, max_width, line_width):
         # memory of the last) prevents shaping characters (arabic, for
         # instance) from keeping their shape when wrapped on the next line with
         # pango layout.  Maybe insert Unicode shaping characters in text ?
-        temp_layout = create_layout(new_first_line, style, hinting, max_width)
+        temp_layout = create_layout(
+            new_first_line, style, hinting, max_width, text_run, start)
         temp_layout.set_wrap(PANGO_WRAP_MODE['WRAP_WORD_CHAR'])
         temp_lines = temp_layout.iter_lines()
-        temp_first_line = next(temp_lines, None)
+        next(temp_lines, None)  # Skip the first line
         temp_second_line = next(temp_lines, None)
         temp_second_line_index = (
             len(new_first_line) if temp_second_line is None
             else temp_second_line.start_index)
         resume_at = temp_second_line_index
-        first_part = utf8_slice(text, slice(temp_second_line_index))
-        layout = create_layout(first_part, style, hinting, max_width)
+        first_part = text_run.slice(
+            start, start + temp_second_line_index)
+        layout = create_layout(
+            first_part, style, hinting, max_width, text_run, start)
         lines = layout.iter_lines()
         first_line = next(lines, None)
 
-    return first_line_metrics(first_line, text, layout, resume_at, hyphenated)
+    return first_line_metrics(
+        first_line, layout, resume_at, hyphenated)
+
 
+def line_widths(text, style, enable_hinting, width, cache=None):
+    """Return a list of the widths of each line.
 
-def line_widths(text, style, enable_hinting, width):
-    """Return the width for each line."""
+    :param cache:
+        An optional dict-like object (typically a :class:`LRUCache`) where
+        results are kept for the same text, font, spacing and width.
+
+    """
+    if cache is not None:
+        key = (text, font_key(style, style.font_size), style.letter_spacing,
+               style.word_spacing, width, bool(enable_hinting))
+        widths = cache.get(key)
+        if widths is not None:
+            return widths
     layout = create_layout(text, style, enable_hinting, width)
-    for line in layout.iter_lines():
-        width, _height = get_size(line)
-        yield width
+    widths = [get_size(line)[0] for line in layout.iter_lines()]
+    layout.release()
+    if cache is not None:
+        cache[key] = widths
+    return widths
 
 
 def show_first_line(context, pango_layout, hinting):
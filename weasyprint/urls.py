@@ -15,10 +15,15 @@ from __future__ import division, unicode_literals
 import io
 import re
 import sys
+import mmap
+import socket
+import hashlib
 import codecs
 import os.path
 import mimetypes
 import contextlib
+import collections
+import threading
 import gzip
 import zlib
 import traceback
@@ -28,7 +33,10 @@ from .logger import LOGGER
 from .compat import (
     urljoin, urlsplit, quote, unquote, unquote_to_bytes, urlopen,
     urllib_get_content_type, urllib_get_charset, urllib_get_filename, Request,
-    parse_email, pathname2url, unicode, base64_decode, StreamingGzipFile)
+    parse_email, pathname2url, unicode, base64_decode, StreamingGzipFile,
+    HTTPConnection, HTTPSConnection, HTTPException, HTTPError, url2pathname,
+    getproxies, proxy_bypass)
+from .lru import LRUCache
 
 
 # Unlinke HTML, CSS and PNG, the SVG MIME type is not always builtin
@@ -191,10 +199,31 @@ def safe_base64_decode(data):
     return base64_decode(data)
 
 
+# Results of decode_data_url(), by digest of the URL
+DATA_URL_CACHE = LRUCache(
+    maxsize=16 * 1024 * 1024, getsize=lambda result: len(result['string']))
+
+
 def open_data_url(url):
     """Decode URLs with the 'data' scheme. urllib can handle them
     in Python 2, but that is broken in Python 3.
 
+    Decoded URLs are kept in :obj:`DATA_URL_CACHE`, by digest: identical
+    URLs repeated in documents are only decoded once.
+
+    """
+    key = hashlib.sha1(url.encode('utf8')).digest()
+    result = DATA_URL_CACHE.get(key)
+    if result is None:
+        result = decode_data_url(url)
+        DATA_URL_CACHE[key] = result
+    # Callers may modify the dict, but not the immutable content.
+    return dict(result)
+
+
+def decode_data_url(url):
+    """Decode URLs with the 'data' scheme.
+
     Inspired from Python 2.7.2’s urllib.py.
 
     """
@@ -238,6 +267,12 @@ HTTP_HEADERS = {
 }
 
 
+# The ConnectionPool used by default_url_fetcher, see set_connection_pool_size
+CONNECTION_POOL = None
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+
 def default_url_fetcher(url):
     """Fetch an external resource such as an image or stylesheet.
 
@@ -273,33 +308,101 @@ def default_url_fetcher(url):
         return open_data_url(url)
     elif UNICODE_SCHEME_RE.match(url):
         url = iri_to_uri(url)
-        response = urlopen(Request(url, headers=HTTP_HEADERS))
-        result = dict(redirected_url=response.geturl(),
-                      mime_type=urllib_get_content_type(response),
-                      encoding=urllib_get_charset(response),
-                      filename=urllib_get_filename(response))
-        content_encoding = response.info().get('Content-Encoding')
-        if content_encoding == 'gzip':
-            if StreamingGzipFile is None:
-                result['string'] = gzip.GzipFile(
-                    fileobj=io.BytesIO(response.read())).read()
-                response.close()
-            else:
-                result['file_obj'] = StreamingGzipFile(fileobj=response)
-        elif content_encoding == 'deflate':
-            data = response.read()
-            try:
-                result['string'] = zlib.decompress(data)
-            except zlib.error:
-                # Try without zlib header or checksum
-                result['string'] = zlib.decompress(data, -15)
-        else:
-            result['file_obj'] = response
-        return result
+        if url.lower().startswith('file:'):
+            result = open_file_url(url)
+            if result is not None:
+                return result
+        response = open_url(url, HTTP_HEADERS)
+        return response_to_result(response)
     else:
         raise ValueError('Not an absolute URI: %r' % url)
 
 
+class MappedFile(object):
+    """A local file mapped in memory, read like a file object.
+
+    ``mapping`` is the :class:`mmap.mmap` object, that can be sliced
+    without copying the whole file.
+
+    """
+    def __init__(self, mapping):
+        self.mapping = mapping
+
+    def read(self, size=-1):
+        # mmap.read() requires a size on Python 2.
+        if size is None or size < 0:
+            size = len(self.mapping)
+        return self.mapping.read(size)
+
+    def close(self):
+        self.mapping.close()
+
+
+def open_file_url(url):
+    """Open a local file URL with ``mmap``.
+
+    The ``file_obj`` of the result is a :class:`MappedFile`: the content of
+    the file is only copied when read. Return :obj:`None` for URLs with a
+    remote host or a query string, handled by ``urlopen()``.
+
+    """
+    _scheme, netloc, path, query, _fragment = urlsplit(url)
+    if netloc not in ('', 'localhost') or query:
+        return None
+    filename = url2pathname(path)
+    with open(filename, 'rb') as fd:
+        try:
+            file_obj = MappedFile(
+                mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ))
+        except ValueError:
+            # Empty files can not be mapped.
+            file_obj = io.BytesIO()
+    return dict(file_obj=file_obj, redirected_url=url,
+                mime_type=mimetypes.guess_type(filename)[0] or 'text/plain',
+                encoding=None, filename=None)
+
+
+def open_url(url, headers):
+    """Open an URL with ``urlopen()``, or with :obj:`CONNECTION_POOL` for
+    HTTP and HTTPS URLs if it is enabled.
+
+    """
+    pool = CONNECTION_POOL
+    if pool is not None and url.lower().startswith(('http:', 'https:')):
+        return pool.open(url, headers)
+    return urlopen(Request(url, headers=headers))
+
+
+def response_to_result(response):
+    """Return an url_fetcher result for a response from ``urlopen()``.
+
+    The body is decompressed according to the *Content-Encoding* header.
+
+    """
+    result = dict(redirected_url=response.geturl(),
+                  mime_type=urllib_get_content_type(response),
+                  encoding=urllib_get_charset(response),
+                  filename=urllib_get_filename(response))
+    content_encoding = response.info().get('Content-Encoding')
+    if content_encoding == 'gzip':
+        if StreamingGzipFile is None:
+            result['string'] = gzip.GzipFile(
+                fileobj=io.BytesIO(response.read())).read()
+            response.close()
+        else:
+            result['file_obj'] = StreamingGzipFile(fileobj=response)
+    elif content_encoding == 'deflate':
+        data = response.read()
+        try:
+            result['string'] = zlib.decompress(data)
+        except zlib.error:
+            # Try without zlib header or checksum
+            result['string'] = zlib.decompress(data, -15)
+    else:
+        result['file_obj'] = response
+    return result
+
+
 class URLFetchingError(IOError):
     """Some error happened when fetching an URL."""
 
@@ -328,3 +431,248 @@ def fetch(url_fetcher, url):
                                url, traceback.format_exc())
     else:
         yield result
+
+
+class PrefetchingURLFetcher(object):
+    """An url_fetcher that fetches URLs in advance, in worker threads.
+
+    URLs given to :meth:`prefetch` are fetched in the background by at most
+    ``concurrency`` threads calling ``url_fetcher``, which must then be
+    thread-safe. Calling this object with one of these URLs waits for its
+    result and gives it, only once. Other URLs are fetched directly.
+
+    """
+    def __init__(self, url_fetcher, concurrency):
+        self.url_fetcher = url_fetcher
+        self.concurrency = concurrency
+        self.lock = threading.Lock()
+        # URLs waiting for a worker, in order
+        self.queue = collections.deque()
+        # keys: URLs
+        # values: [event set when done, result dict, exception]
+        self.results = {}
+        self.workers = 0
+
+    def prefetch(self, urls):
+        """Start fetching ``urls`` in the background."""
+        # Consume iterators before taking the lock: they may compute
+        # styles and block the workers.
+        # data: URLs do not need any I/O.
+        urls = [url for url in urls if not url.startswith('data:')]
+        with self.lock:
+            for url in urls:
+                if url in self.results:
+                    continue
+                self.results[url] = [threading.Event(), None, None]
+                self.queue.append(url)
+            new_workers = min(
+                self.concurrency - self.workers, len(self.queue))
+            self.workers += new_workers
+        for _i in range(new_workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+
+    def close(self):
+        """Cancel the URLs not being fetched yet and forget the results."""
+        with self.lock:
+            self.queue.clear()
+            self.results.clear()
+
+    def _work(self):
+        while True:
+            with self.lock:
+                if not self.queue:
+                    self.workers -= 1
+                    return
+                url = self.queue.popleft()
+                entry = self.results[url]
+            try:
+                result = self.url_fetcher(url)
+                if 'file_obj' in result:
+                    # Read the whole response in this thread.
+                    file_obj = result.pop('file_obj')
+                    try:
+                        result['string'] = file_obj.read()
+                    finally:
+                        file_obj.close()
+                entry[1] = result
+            except Exception as exc:
+                entry[2] = exc
+            entry[0].set()
+
+    def __call__(self, url):
+        with self.lock:
+            entry = self.results.pop(url, None)
+            if entry is not None and url in self.queue:
+                # Not started yet, fetch it now.
+                self.queue.remove(url)
+                entry = None
+        if entry is None:
+            return self.url_fetcher(url)
+        entry[0].wait()
+        _event, result, exception = entry
+        if exception is not None:
+            raise exception
+        return result
+
+
+def set_connection_pool_size(maxsize):
+    """Keep HTTP connections open between resources fetched by
+    :func:`default_url_fetcher`.
+
+    :param maxsize:
+        The maximum number of idle connections kept for each host, or ``0``
+        to open a new connection for each resource (the default).
+
+    """
+    global CONNECTION_POOL
+    if CONNECTION_POOL is not None:
+        CONNECTION_POOL.close()
+    CONNECTION_POOL = ConnectionPool(maxsize) if maxsize else None
+
+
+def uses_proxy(url):
+    """Return whether ``urlopen()`` would use a proxy for ``url``.
+
+    Proxies are given by the ``http_proxy``, ``https_proxy`` and
+    ``no_proxy`` environment variables, or by the system settings.
+
+    """
+    scheme, netloc, _path, _query, _fragment = urlsplit(url)
+    if scheme.lower() not in getproxies():
+        return False
+    # Remove the credentials, keep the host and the port.
+    return not proxy_bypass(netloc.rpartition('@')[2])
+
+
+class ConnectionPool(object):
+    """An url_fetcher keeping HTTP connections open to reuse them.
+
+    At most ``maxsize`` idle connections are kept for each host. Redirections
+    are followed, and responses are decoded like in
+    :func:`default_url_fetcher`. Other URLs than HTTP and HTTPS are given to
+    :func:`default_url_fetcher`, and URLs fetched through a proxy are opened
+    with ``urlopen()``.
+
+    """
+    def __init__(self, maxsize=4, timeout=None, max_redirects=10):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.lock = threading.Lock()
+        # keys: (scheme, host and port)
+        # values: lists of idle connections
+        self.connections = {}
+
+    def __call__(self, url):
+        if not url.lower().startswith(('http:', 'https:')):
+            return default_url_fetcher(url)
+        return response_to_result(self.open(iri_to_uri(url), HTTP_HEADERS))
+
+    def open(self, url, headers):
+        """Send a GET request and return a response like ``urlopen()``.
+
+        :raises: :class:`HTTPError` for statuses other than 2xx.
+
+        """
+        for _i in range(self.max_redirects + 1):
+            if uses_proxy(url):
+                # Connections to proxies are not pooled.
+                return urlopen(Request(url, headers=headers))
+            key, connection, response = self._request(url, headers)
+            status = response.status
+            if 200 <= status < 300:
+                return PooledResponse(self, key, connection, response, url)
+            location = response.getheader('Location')
+            # Read the body to reuse the connection.
+            PooledResponse(self, key, connection, response, url).read()
+            if status in REDIRECT_STATUSES and location:
+                url = iri_to_uri(urljoin(url, location))
+            else:
+                raise HTTPError(
+                    url, status, response.reason, response.msg, None)
+        raise HTTPError(url, status, 'Too many redirections', response.msg,
+                        None)
+
+    def close(self):
+        """Close all the idle connections."""
+        with self.lock:
+            connections = self.connections
+            self.connections = {}
+        for idle in connections.values():
+            for connection in idle:
+                connection.close()
+
+    def _request(self, url, headers):
+        scheme, netloc, path, query, _fragment = urlsplit(url)
+        key = scheme.lower(), netloc
+        target = (path or '/') + ('?' + query if query else '')
+        while True:
+            with self.lock:
+                idle = self.connections.get(key)
+                connection = idle.pop() if idle else None
+            reused = connection is not None
+            if not reused:
+                connection_class = (
+                    HTTPSConnection if key[0] == 'https' else HTTPConnection)
+                if self.timeout is None:
+                    connection = connection_class(netloc)
+                else:
+                    connection = connection_class(
+                        netloc, timeout=self.timeout)
+            try:
+                connection.request('GET', target, headers=headers)
+                return key, connection, connection.getresponse()
+            except (HTTPException, socket.error):
+                connection.close()
+                if not reused:
+                    raise
+                # The server closed an idle connection, try another one.
+
+    def _release(self, key, connection):
+        with self.lock:
+            idle = self.connections.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append(connection)
+                return
+        connection.close()
+
+
+class PooledResponse(object):
+    """A response of a :class:`ConnectionPool`, like those of ``urlopen()``.
+
+    The connection goes back to the pool once the body is read.
+
+    """
+    def __init__(self, pool, key, connection, response, url):
+        self.pool = pool
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.url = url
+        self.code = response.status
+
+    def geturl(self):
+        return self.url
+
+    def info(self):
+        return self.response.msg
+
+    def read(self, *args):
+        data = self.response.read(*args)
+        if self.connection is not None and self.response.isclosed():
+            # The whole body has been read.
+            connection, self.connection = self.connection, None
+            if self.response.will_close:
+                connection.close()
+            else:
+                self.pool._release(self.key, connection)
+        return data
+
+    def close(self):
+        if self.connection is not None:
+            # Unread body, the connection can not be reused.
+            connection, self.connection = self.connection, None
+            self.response.close()
+            connection.close()